@@ -22,7 +22,7 @@ import csv
 import requests
 import urllib3
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List
 
 # Disable SSL warnings if verify_ssl is False
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
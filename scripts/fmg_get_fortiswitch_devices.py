@@ -19,14 +19,94 @@ Version: 2.0 (Proxy Implementation)
 import os
 import sys
 import csv
+import re
 import requests
 import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+
+    def _json_pretty(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+except ImportError:  # Fall back to the standard library if orjson isn't installed
+    import json
+
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+    def _json_pretty(obj) -> str:
+        return json.dumps(obj, indent=2)
 
 # Disable SSL warnings if verify_ssl is False
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Number of FortiGates queried per proxy request
+PROXY_CHUNK_SIZE = 25
+
+# Number of proxy requests in flight at once
+PROXY_MAX_WORKERS = 8
+
+# Model prefix of a FortiSwitch firmware string (e.g., S224EN, FS1E48, SM24GF)
+_MODEL_RE = re.compile(r'^([A-Z0-9]+)-')
+
+# Unified 60-field structure - same order for all systems
+FIELDNAMES = (
+    # Section 1: Core Identification
+    'Serial Number', 'Device Name', 'Hostname', 'Model', 'Description',
+    'Asset Type', 'Source System',
+
+    # Section 2: Network & Connection
+    'Management IP', 'Connection Status', 'Management Mode', 'Firmware Version',
+
+    # Section 3: Organization & Location
+    'Company', 'Organizational Unit', 'Branch', 'Location',
+    'Folder Path', 'Folder ID', 'Vendor',
+
+    # Section 4: Contract Information
+    'Contract Number', 'Contract SKU', 'Contract Type', 'Contract Summary',
+    'Contract Start Date', 'Contract Expiration Date', 'Contract Status',
+    'Contract Support Type', 'Contract Archived',
+
+    # Section 5: Entitlement Information
+    'Entitlement Level', 'Entitlement Type',
+    'Entitlement Start Date', 'Entitlement End Date',
+
+    # Section 6: Lifecycle & Status
+    'Status', 'Is Decommissioned', 'Archived', 'Registration Date',
+    'Product EoR', 'Product EoS', 'Last Updated',
+
+    # Section 7: Account Information
+    'Account ID', 'Account Email', 'Account OU ID',
+
+    # Section 8: FortiGate-Specific Fields
+    'HA Mode', 'HA Cluster Name', 'HA Role', 'HA Member Status',
+    'HA Priority', 'Max VDOMs',
+
+    # Section 9: FortiSwitch/FortiAP Parent Tracking
+    'Parent FortiGate', 'Parent FortiGate Serial',
+    'Parent FortiGate Platform', 'Parent FortiGate IP',
+
+    # Section 10: FortiSwitch-Specific Fields
+    'Device Type', 'Max PoE Budget', 'Join Time',
+
+    # Section 11: FortiAP-Specific Fields
+    'Board MAC', 'Admin Status', 'Client Count', 'Mesh Uplink',
+    'WTP Mode', 'VDOM'
+)
+
+# Row with every field empty; copied and filled in per switch
+_EMPTY_ROW = dict.fromkeys(FIELDNAMES, '')
+
 
 class FortiManagerAPI:
     """FortiManager API client with token-based authentication."""
@@ -45,6 +125,21 @@ class FortiManagerAPI:
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.api_key}'
         })
+        # Pool enough connections for the concurrent proxy requests and retry
+        # transient gateway errors; every call here is a read-only query
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=frozenset(['POST'])
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(16, PROXY_MAX_WORKERS),
+            max_retries=retry
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
     def exec_request(self, method: str, params: List[Dict], request_id: int = 1) -> Dict:
         """Execute a JSON RPC request to FortiManager."""
@@ -56,26 +151,25 @@ class FortiManagerAPI:
 
         if self.debug:
             print(f"\nDEBUG Request:")
-            import json
-            print(json.dumps(payload, indent=2))
+            print(_json_pretty(payload))
 
         try:
             response = self.session.post(
                 self.api_url,
-                json=payload,
+                data=_json_dumps(payload),
                 verify=self.verify_ssl,
                 timeout=120
             )
             response.raise_for_status()
-            result = response.json()
+            result = _json_loads(response.content)
 
             if self.debug:
                 print(f"\nDEBUG Response:")
-                print(json.dumps(result, indent=2)[:1000])
+                print(_json_pretty(result)[:1000])
 
             return result
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             print(f"[!] API Request failed: {e}")
             sys.exit(1)
 
@@ -105,29 +199,39 @@ class FortiManagerAPI:
         print(f"[+] Found {len(devices)} FortiGate devices")
         return devices
 
-    def get_fortiswitches_via_proxy(self, fortigates: List[Dict]) -> List[Dict]:
+    def get_fortiswitches_via_proxy(self, fortigates: List[Dict]) -> Iterator[Dict]:
         """
         Get all FortiSwitch devices by proxying FortiGate REST API requests.
         
         Uses /sys/proxy/json to query all FortiGates for their managed switches.
         FortiGate REST API endpoint: /api/v2/monitor/switch-controller/managed-switch/status
+        
+        Targets are split into chunks of PROXY_CHUNK_SIZE and queried concurrently,
+        so one slow FortiGate only stalls its own chunk and response size stays bounded.
+        Per-device responses are yielded chunk by chunk as they become available.
         """
         print("[*] Querying all FortiGates for FortiSwitch devices (via proxy)...")
         
         # Build target list from FortiGate devices
-        targets = []
-        for fgt in fortigates:
-            adom = fgt.get('extra info', {}).get('adom', 'root')
-            device_name = fgt.get('name')
-            if device_name:
-                targets.append(f'adom/{adom}/device/{device_name}')
+        targets = [
+            f"adom/{(fgt.get('extra info') or {}).get('adom', 'root')}/device/{fgt['name']}"
+            for fgt in fortigates if fgt.get('name')
+        ]
         
         if not targets:
             print("[!] No FortiGate devices to query")
-            return []
+            return
         
         print(f"[*] Querying {len(targets)} FortiGate device(s)...")
         
+        chunks = [targets[i:i + PROXY_CHUNK_SIZE] for i in range(0, len(targets), PROXY_CHUNK_SIZE)]
+        
+        with ThreadPoolExecutor(max_workers=PROXY_MAX_WORKERS) as executor:
+            for chunk_responses in executor.map(self._query_chunk, chunks):
+                yield from chunk_responses
+
+    def _query_chunk(self, targets: List[str]) -> List[Dict]:
+        """Query one chunk of FortiGate targets for their managed switches."""
         params = [{
             'url': '/sys/proxy/json',
             'data': {
@@ -158,9 +262,13 @@ class FortiSwitchExporter:
     def __init__(self, api: FortiManagerAPI):
         self.api = api
         self.fortigates = {}  # Cache FortiGate info by name
+        self._export_timestamp = ''
+
+    def iter_switches(self) -> Iterator[Tuple]:
+        """Yield a CSV row for every FortiSwitch device on all FortiGates."""
+        # One 'Last Updated' value for the whole export
+        self._export_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    def process_switches(self) -> List[Dict]:
-        """Process all FortiSwitch devices from all FortiGates."""
         # First, get all FortiGates to build a lookup table
         fortigate_list = self.api.get_all_fortigates()
         for fgt in fortigate_list:
@@ -175,7 +283,6 @@ class FortiSwitchExporter:
         # Get FortiSwitch devices via proxy
         proxy_responses = self.api.get_fortiswitches_via_proxy(fortigate_list)
         
-        all_switches = []
         total_switches = 0
         fortigates_with_switches = 0
 
@@ -211,16 +318,14 @@ class FortiSwitchExporter:
 
             # Process each switch
             for switch in switches:
-                switch_info = self._extract_switch_info(
+                yield self._extract_switch_info(
                     switch, 
                     target_name, 
                     parent_fgt,
                     response_data
                 )
-                all_switches.append(switch_info)
 
         print(f"\n[*] Summary: {total_switches} FortiSwitch device(s) from {fortigates_with_switches} FortiGate(s)")
-        return all_switches
 
     def _extract_model_from_firmware(self, firmware: str) -> str:
         """
@@ -230,17 +335,11 @@ class FortiSwitchExporter:
         if not firmware:
             return ''
         
-        # Try to extract model prefix (e.g., S224EN, FS1E48, SM24GF)
-        import re
-        match = re.match(r'^([A-Z0-9]+)-', firmware)
-        if match:
-            model_code = match.group(1)
-            return f"FortiSwitch-{model_code}"
-        
-        return ''
+        match = _MODEL_RE.match(firmware)
+        return f"FortiSwitch-{match.group(1)}" if match else ''
 
-    def _extract_switch_info(self, switch: Dict, parent_name: str, parent_fgt: Dict, response: Dict) -> Dict:
-        """Extract and format FortiSwitch information using unified 60-field structure."""
+    def _extract_switch_info(self, switch: Dict, parent_name: str, parent_fgt: Dict, response: Dict) -> Tuple:
+        """Extract and format FortiSwitch information as a row in FIELDNAMES order."""
         # Get connection status
         state = switch.get('state', 'unknown')
         connection_status = 'Connected' if state == 'Authorized' else state
@@ -267,14 +366,12 @@ class FortiSwitchExporter:
         # ADOM and company
         adom = parent_fgt.get('adom', '')
         
-        # Last updated
-        last_updated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
         # PoE budget
         max_poe_budget = str(switch.get('max_poe_budget', '')) if switch.get('max_poe_budget') else ''
         
-        # Return unified 60-field structure
-        return {
+        # Populated fields of the unified 60-field structure; the rest stay empty
+        row = _EMPTY_ROW.copy()
+        row.update({
             # Section 1: Core Identification
             'Serial Number': serial_number,
             'Device Name': device_name,
@@ -283,145 +380,88 @@ class FortiSwitchExporter:
             'Description': description,
             'Asset Type': 'Switch',
             'Source System': 'FortiManager',
-            
+
             # Section 2: Network & Connection
             'Management IP': parent_fgt.get('ip', ''),
             'Connection Status': connection_status,
-            'Management Mode': '',
             'Firmware Version': firmware,
-            
+
             # Section 3: Organization & Location
             'Company': adom,
             'Organizational Unit': adom,
-            'Branch': '',
-            'Location': '',
-            'Folder Path': '',
-            'Folder ID': '',
             'Vendor': 'Fortinet',
-            
-            # Section 4: Contract Information (all empty for FortiManager)
-            'Contract Number': '',
-            'Contract SKU': '',
-            'Contract Type': '',
-            'Contract Summary': '',
-            'Contract Start Date': '',
-            'Contract Expiration Date': '',
-            'Contract Status': '',
-            'Contract Support Type': '',
-            'Contract Archived': '',
-            
-            # Section 5: Entitlement Information (all empty for FortiManager)
-            'Entitlement Level': '',
-            'Entitlement Type': '',
-            'Entitlement Start Date': '',
-            'Entitlement End Date': '',
-            
+
             # Section 6: Lifecycle & Status
             'Status': connection_status,
             'Is Decommissioned': 'No',
             'Archived': 'No',
-            'Registration Date': '',
-            'Product EoR': '',
-            'Product EoS': '',
-            'Last Updated': last_updated,
-            
-            # Section 7: Account Information (all empty for FortiManager)
-            'Account ID': '',
-            'Account Email': '',
-            'Account OU ID': '',
-            
-            # Section 8: FortiGate-Specific Fields (empty for FortiSwitch)
-            'HA Mode': '',
-            'HA Cluster Name': '',
-            'HA Role': '',
-            'HA Member Status': '',
-            'HA Priority': '',
-            'Max VDOMs': '',
-            
+            'Last Updated': self._export_timestamp,
+
             # Section 9: FortiSwitch/FortiAP Parent Tracking
             'Parent FortiGate': parent_name,
             'Parent FortiGate Serial': parent_fgt.get('serial', ''),
             'Parent FortiGate Platform': parent_fgt.get('platform', ''),
             'Parent FortiGate IP': parent_fgt.get('ip', ''),
-            
+
             # Section 10: FortiSwitch-Specific Fields
             'Device Type': 'physical',
             'Max PoE Budget': max_poe_budget,
             'Join Time': switch.get('join_time', ''),
-            
-            # Section 11: FortiAP-Specific Fields (empty for FortiSwitch)
-            'Board MAC': '',
-            'Admin Status': '',
-            'Client Count': '',
-            'Mesh Uplink': '',
-            'WTP Mode': '',
-            'VDOM': response.get('vdom', 'root')
-        }
-
-    def export_to_csv(self, switches: List[Dict], filename: str):
-        """Export FortiSwitch devices to CSV file using unified 60-field structure."""
-        if not switches:
-            print(f"[!]  No FortiSwitch devices to export")
-            return
 
-        # Unified 60-field structure - same order for all systems
-        fieldnames = [
-            # Section 1: Core Identification
-            'Serial Number', 'Device Name', 'Hostname', 'Model', 'Description', 
-            'Asset Type', 'Source System',
-            
-            # Section 2: Network & Connection
-            'Management IP', 'Connection Status', 'Management Mode', 'Firmware Version',
-            
-            # Section 3: Organization & Location
-            'Company', 'Organizational Unit', 'Branch', 'Location', 
-            'Folder Path', 'Folder ID', 'Vendor',
-            
-            # Section 4: Contract Information
-            'Contract Number', 'Contract SKU', 'Contract Type', 'Contract Summary',
-            'Contract Start Date', 'Contract Expiration Date', 'Contract Status',
-            'Contract Support Type', 'Contract Archived',
-            
-            # Section 5: Entitlement Information
-            'Entitlement Level', 'Entitlement Type', 
-            'Entitlement Start Date', 'Entitlement End Date',
-            
-            # Section 6: Lifecycle & Status
-            'Status', 'Is Decommissioned', 'Archived', 'Registration Date',
-            'Product EoR', 'Product EoS', 'Last Updated',
-            
-            # Section 7: Account Information
-            'Account ID', 'Account Email', 'Account OU ID',
-            
-            # Section 8: FortiGate-Specific Fields
-            'HA Mode', 'HA Cluster Name', 'HA Role', 'HA Member Status', 
-            'HA Priority', 'Max VDOMs',
-            
-            # Section 9: FortiSwitch/FortiAP Parent Tracking
-            'Parent FortiGate', 'Parent FortiGate Serial', 
-            'Parent FortiGate Platform', 'Parent FortiGate IP',
-            
-            # Section 10: FortiSwitch-Specific Fields
-            'Device Type', 'Max PoE Budget', 'Join Time',
-            
             # Section 11: FortiAP-Specific Fields
-            'Board MAC', 'Admin Status', 'Client Count', 'Mesh Uplink', 
-            'WTP Mode', 'VDOM'
-        ]
+            'VDOM': response.get('vdom', 'root')
+        })
+        return tuple(row.values())
 
-        try:
-            with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(switches)
+    def export_to_csv(self, switches: Iterable[Tuple], filename: str) -> int:
+        """
+        Export FortiSwitch devices to CSV file using unified 60-field structure.
 
-            print(f"[+] CSV export successful: {filename}")
-            print(f"[+] Total rows: {len(switches)}")
+        Rows are written as they are produced, so the full fleet is never held
+        in memory. They go to a temporary file that only replaces `filename`
+        once every row has been written, so a failed run never leaves a
+        truncated CSV behind. Returns the number of rows written.
+        """
+        switches = iter(switches)
+
+        def next_row():
+            # Rows are fetched lazily, so retrieval errors surface here
+            try:
+                return next(switches, None)
+            except Exception as e:
+                print(f"[!] Failed to retrieve FortiSwitch data: {e}")
+                sys.exit(1)
+
+        row = next_row()
+        if row is None:
+            print(f"[!]  No FortiSwitch devices to export")
+            return 0
 
-        except Exception as e:
+        tmp_filename = f'{filename}.partial'
+        try:
+            with open(tmp_filename, 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(FIELDNAMES)
+                count = 0
+                while row is not None:
+                    writer.writerow(row)
+                    count += 1
+                    row = next_row()
+            os.replace(tmp_filename, filename)
+
+        except (OSError, csv.Error) as e:
             print(f"[!] Failed to write CSV: {e}")
             sys.exit(1)
 
+        finally:
+            # Covers write errors as well as retrieval errors and exits
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+        print(f"[+] CSV export successful: {filename}")
+        print(f"[+] Total rows: {count}")
+        return count
+
 
 def load_config(config_file: str = 'fortimanagerapikey') -> Dict[str, str]:
     """Load configuration from file or environment variables."""
@@ -437,8 +477,11 @@ def load_config(config_file: str = 'fortimanagerapikey') -> Dict[str, str]:
             with open(config_path, 'r') as f:
                 for line in f:
                     line = line.strip()
-                    if line and '=' in line and not line.startswith('#'):
-                        key, value = line.split('=', 1)
+                    # Comments, blank lines and lines without '=' are skipped
+                    if not line or line.startswith('#'):
+                        continue
+                    key, sep, value = line.partition('=')
+                    if sep:
                         config[key.strip()] = value.strip()
         except Exception as e:
             print(f"[!]  Error reading config file: {e}")
@@ -500,15 +543,12 @@ def main():
     # Initialize exporter
     exporter = FortiSwitchExporter(api)
 
-    # Process FortiSwitch devices
-    switches = exporter.process_switches()
-
     # Generate CSV filename
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     csv_filename = f'fmg_fortiswitch_devices_{timestamp}.csv'
 
-    # Export to CSV
-    exporter.export_to_csv(switches, csv_filename)
+    # Process FortiSwitch devices and stream them to CSV
+    exporter.export_to_csv(exporter.iter_switches(), csv_filename)
 
     print()
     print("=" * 70)
@@ -0,0 +1,884 @@
+"""
+FortiCloud API - Shared Client and Export Helpers
+
+Common code for the fc_get_* scripts:
+1. FortiCloudAPI client with OAuth 2.0 Password Grant and token caching
+2. Organizational unit and account discovery
+3. Flattening of FortiCloud assets to the unified 60-field structure
+4. CSV export and credential loading
+
+Author: FortiCloud API Project
+Date: October 1, 2025
+Version: 2.0
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from dotenv import load_dotenv
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:  # Fall back to the standard library if orjson isn't installed
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# Unified 60-field structure - same order for all systems
+FIELDNAMES = (
+    'Serial Number', 'Device Name', 'Hostname', 'Model', 'Description',
+    'Asset Type', 'Source System',
+    'Management IP', 'Connection Status', 'Management Mode', 'Firmware Version',
+    'Company', 'Organizational Unit', 'Branch', 'Location',
+    'Folder Path', 'Folder ID', 'Vendor',
+    'Contract Number', 'Contract SKU', 'Contract Type', 'Contract Summary',
+    'Contract Start Date', 'Contract Expiration Date', 'Contract Status',
+    'Contract Support Type', 'Contract Archived',
+    'Entitlement Level', 'Entitlement Type',
+    'Entitlement Start Date', 'Entitlement End Date',
+    'Status', 'Is Decommissioned', 'Archived', 'Registration Date',
+    'Product EoR', 'Product EoS', 'Last Updated',
+    'Account ID', 'Account Email', 'Account OU ID',
+    'HA Mode', 'HA Cluster Name', 'HA Role', 'HA Member Status',
+    'HA Priority', 'Max VDOMs',
+    'Parent FortiGate', 'Parent FortiGate Serial',
+    'Parent FortiGate Platform', 'Parent FortiGate IP',
+    'Device Type', 'Max PoE Budget', 'Join Time',
+    'Board MAC', 'Admin Status', 'Client Count', 'Mesh Uplink',
+    'WTP Mode', 'VDOM'
+)
+
+# Asset Management API used when FORTICLOUD_API_BASE_URL is not set
+DEFAULT_API_BASE_URL = "https://support.fortinet.com/ES/api/registration/v3"
+
+# Write buffer for CSV output, so large exports use few write() calls
+CSV_BUFFER_SIZE = 1 << 20
+
+# Number of accounts queried for devices at once
+MAX_WORKERS = 16
+
+# Extra pages of a single account's product list fetched at once; kept in a
+# separate pool so page fetches never wait on the account workers
+PAGE_WORKERS = 8
+
+# Connections kept open per host; at least one per worker thread
+POOL_MAXSIZE = 32
+
+# Every response compression urllib3 can decode here (gzip and deflate, plus
+# br/zstd when those packages are installed)
+ACCEPT_ENCODING = make_headers(accept_encoding=True)['accept-encoding']
+
+# Where access tokens are cached between runs (override with FORTICLOUD_TOKEN_CACHE,
+# set it empty to disable)
+TOKEN_CACHE_FILE = '~/.forticloud_tokens.json'
+
+# Cached tokens are treated as expired this many seconds early
+TOKEN_EXPIRY_MARGIN = 60
+
+# Rate limiting (HTTP 429): retries, and exponential backoff with jitter used
+# when the server doesn't send Retry-After
+RATE_LIMIT_RETRIES = 5
+RATE_LIMIT_BASE_DELAY = 1.0
+RATE_LIMIT_MAX_DELAY = 30.0
+RATE_LIMIT_JITTER = 0.5
+
+
+def _make_adapter() -> HTTPAdapter:
+    """
+    Create an adapter whose connection pool can serve every worker thread.
+    
+    Transient server errors are retried with backoff. All FortiCloud calls are
+    read-only list queries or logins, so retrying POST is safe. Rate limiting
+    is handled separately by FortiCloudAPI._with_rate_limit.
+    """
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=frozenset(['GET', 'POST'])
+    )
+    return HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=False,
+        max_retries=retry
+    )
+
+
+def _make_session(adapter: HTTPAdapter) -> requests.Session:
+    """Create a JSON session on top of a shared connection pool."""
+    session = requests.Session()
+    session.headers['Connection'] = 'keep-alive'
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    session.headers['Content-Type'] = 'application/json'
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _rate_limit_delay(response: requests.Response, attempt: int) -> float:
+    """
+    Seconds to wait before retrying a rate-limited request.
+    
+    Uses the server's Retry-After (seconds or HTTP date) when present, otherwise
+    exponential backoff with jitter so concurrent workers don't retry in
+    lockstep. Either way the wait is capped at RATE_LIMIT_MAX_DELAY, since a
+    token request backs off while holding its service's session lock.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        if retry_after.isdigit():
+            return min(RATE_LIMIT_MAX_DELAY, float(retry_after))
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+            delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+            return min(RATE_LIMIT_MAX_DELAY, max(0.0, delay))
+        except (TypeError, ValueError):
+            pass
+    delay = min(RATE_LIMIT_MAX_DELAY, RATE_LIMIT_BASE_DELAY * 2 ** attempt)
+    return delay * (1 + random.uniform(0, RATE_LIMIT_JITTER))
+
+
+@lru_cache(maxsize=None)
+def _products_payload_template(serial_pattern: str) -> bytes:
+    """
+    Build the products/list JSON body once per serial pattern.
+    
+    Only the account ID changes between requests, so it is left as a %d
+    placeholder to be filled in per account. productModel is deliberately
+    not sent: the API holds full model names, so devices are filtered by
+    model after retrieval instead.
+    """
+    fields = {"serialNumber": serial_pattern}
+    return b'{"accountId":%d,' + _json_dumps(fields)[1:].replace(b'%', b'%%')
+
+
+class FortiCloudAPI:
+    """FortiCloud API client with OAuth 2.0 authentication."""
+
+    def __init__(self, username: str, password: str, auth_url: str, debug: bool = False,
+                 api_base_url: str = DEFAULT_API_BASE_URL):
+        self.username = username
+        self.password = password
+        self.auth_url = auth_url
+        self.debug = debug
+        
+        # API base URLs
+        self.org_base_url = "https://support.fortinet.com/ES/api/organization/v1"
+        self.iam_base_url = "https://support.fortinet.com/ES/api/iam/v1"
+        self.asset_base_url = api_base_url.rstrip('/')
+        
+        # Endpoints, built once rather than per request
+        self.org_units_url = f"{self.org_base_url}/units/list"
+        self.iam_accounts_url = f"{self.iam_base_url}/accounts/list"
+        self.products_url = f"{self.asset_base_url}/products/list"
+        
+        # Token cache: client_id -> (token, time.monotonic() deadline for reuse)
+        self.tokens: Dict[str, Tuple[str, float]] = {}
+        cache_file = os.getenv('FORTICLOUD_TOKEN_CACHE', TOKEN_CACHE_FILE)
+        self.token_cache_file = os.path.expanduser(cache_file) if cache_file else None
+
+        # One connection pool shared by the token session and every service
+        # session, so all of them reuse the same keep-alive connections
+        self._adapter = _make_adapter()
+        self.auth_session = _make_session(self._adapter)
+
+        # Per-service sessions, each carrying its own Authorization header
+        self.sessions = {}
+        # One lock per service, so logins for different services can run at
+        # once while concurrent requests for the same service log in only once
+        self._session_locks: Dict[str, threading.Lock] = {}
+        # Serializes read-modify-write of the on-disk token cache
+        self._cache_lock = threading.Lock()
+
+        # Accounts already listed per OU ID; the hierarchy does not change
+        # during a run, so each OU is queried at most once
+        self._accounts_cache: Dict[int, List[Dict]] = {}
+
+        # Worker pool shared by every concurrent fan-out (OUs, accounts)
+        self._executor = None
+        # Pool for the remaining pages of multi-page product lists; threads
+        # are only started once a list actually spans several pages
+        self._page_executor = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix='forticloud-page')
+
+    def map(self, fn: Callable, items: Iterable) -> List:
+        """
+        Run fn over items concurrently on the client's worker pool.
+        
+        The pool is created on first use and reused for every later fan-out,
+        so discovery and device retrieval share the same threads.
+        
+        Returns:
+            Results in the same order as items
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='forticloud')
+        return list(self._executor.map(fn, items))
+
+    def close(self) -> None:
+        """Stop the worker pool and close all HTTP sessions."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._page_executor.shutdown()
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+        self.auth_session.close()
+
+    def _log(self, message: str) -> None:
+        """Log debug messages if debug mode is enabled."""
+        if self.debug:
+            print(f"[DEBUG] {message}")
+
+    def _load_token_cache(self) -> Dict[str, Dict]:
+        """Read the on-disk token cache, returning an empty cache if unavailable."""
+        if not self.token_cache_file:
+            return {}
+        try:
+            with open(self.token_cache_file, 'rb') as f:
+                cache = _json_loads(f.read())
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_token_cache(self, cache: Dict[str, Dict]) -> None:
+        """Write the on-disk token cache, readable by the current user only."""
+        if not self.token_cache_file:
+            return
+        try:
+            fd = os.open(self.token_cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_json_dumps(cache))
+            os.chmod(self.token_cache_file, 0o600)
+        except OSError as e:
+            self._log(f"Could not write token cache: {e}")
+
+    def _invalidate_session(self, client_id: str, session: requests.Session) -> None:
+        """Forget a rejected token and its session, in memory and on disk."""
+        with self._session_locks.setdefault(client_id, threading.Lock()):
+            # Another thread may already have logged in again
+            if self.sessions.get(client_id) is not session:
+                return
+            self.tokens.pop(client_id, None)
+            self.sessions.pop(client_id, None)
+            with self._cache_lock:
+                cache = self._load_token_cache()
+                if cache.pop(f"{self.username}:{client_id}", None) is not None:
+                    self._save_token_cache(cache)
+
+    def get_token(self, client_id: str) -> Optional[str]:
+        """
+        Get OAuth token for specific service.
+        
+        Tokens are reused, from memory or the on-disk cache, until shortly
+        before they expire; after that a new token is requested.
+        
+        Args:
+            client_id: Service client ID (organization, iam, assetmanagement)
+        
+        Returns:
+            Access token string or None if authentication fails
+        """
+        if self._token_valid(client_id):
+            return self.tokens[client_id][0]
+        
+        cache_key = f"{self.username}:{client_id}"
+        cache = self._load_token_cache()
+        cached = cache.get(cache_key)
+        # A stale or hand-edited entry without a usable token or expiry time
+        # is treated as a cache miss
+        token = cached.get('token') if isinstance(cached, dict) else None
+        expires_at = cached.get('expires_at') if token else None
+        if (isinstance(token, str) and token
+                and isinstance(expires_at, (int, float)) and not isinstance(expires_at, bool)):
+            remaining = expires_at - time.time() - TOKEN_EXPIRY_MARGIN
+            if remaining > 0:
+                self._log(f"Using cached token for {client_id}")
+                self.tokens[client_id] = (token, time.monotonic() + remaining)
+                return token
+        
+        self._log(f"Requesting token for client_id: {client_id}")
+        
+        try:
+            body = _json_dumps({
+                "username": self.username,
+                "password": self.password,
+                "client_id": client_id,
+                "grant_type": "password"
+            })
+            response = self._with_rate_limit(
+                lambda: self.auth_session.post(self.auth_url, data=body, timeout=30),
+                self.auth_url
+            )
+            response.raise_for_status()
+            
+            data = _json_loads(response.content)
+            token = data.get('access_token')
+            
+            if token:
+                expires_in = data.get('expires_in', 3600)
+                self.tokens[client_id] = (token, time.monotonic() + expires_in - TOKEN_EXPIRY_MARGIN)
+                with self._cache_lock:
+                    # Re-read so tokens saved by concurrent logins are kept
+                    cache = self._load_token_cache()
+                    cache[cache_key] = {
+                        'token': token,
+                        'expires_at': time.time() + expires_in
+                    }
+                    self._save_token_cache(cache)
+                self._log(f"Successfully obtained token for {client_id}")
+                return token
+            else:
+                print(f"ERROR: No access_token in response for {client_id}")
+                return None
+                
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"ERROR: Failed to get token for {client_id}: {e}")
+            return None
+
+    def _token_valid(self, client_id: str) -> bool:
+        """Check whether the in-memory token for a service can still be used."""
+        entry = self.tokens.get(client_id)
+        return entry is not None and time.monotonic() < entry[1]
+
+    def get_session(self, client_id: str) -> Optional[requests.Session]:
+        """
+        Get a session authenticated for a specific service.
+        
+        The bearer token is set once on the session headers so individual
+        requests don't need to rebuild the Authorization header. A token
+        close to expiry is refreshed before it is used, and gets a new session.
+        
+        Args:
+            client_id: Service client ID (organization, iam, assetmanagement)
+        
+        Returns:
+            Authenticated session or None if authentication fails
+        """
+        session = self.sessions.get(client_id)
+        if session is not None and self._token_valid(client_id):
+            return session
+        
+        # Worker threads may ask for the same service at once; log in only once
+        with self._session_locks.setdefault(client_id, threading.Lock()):
+            session = self.sessions.get(client_id)
+            if session is not None and self._token_valid(client_id):
+                return session
+            
+            token = self.get_token(client_id)
+            if not token:
+                return None
+            
+            session = _make_session(self._adapter)
+            session.headers['Authorization'] = f"Bearer {token}"
+            self.sessions[client_id] = session
+            return session
+
+    def _post(self, client_id: str, url: str, payload: Union[Dict, bytes]) -> Optional[requests.Response]:
+        """
+        POST to a service API.
+        
+        Logs in again once if the token is rejected, and backs off and retries
+        up to RATE_LIMIT_RETRIES times while the request is rate limited.
+        
+        Args:
+            client_id: Service client ID (organization, iam, assetmanagement)
+            url: Endpoint URL
+            payload: JSON request body, as a dict or already-encoded bytes
+        
+        Returns:
+            Response, or None if authentication fails
+        """
+        body = payload if isinstance(payload, bytes) else _json_dumps(payload)
+        response = self._with_rate_limit(lambda: self._send(client_id, url, body), url)
+        if response is not None and self.debug:
+            self._log(f"Response from {url}: {len(response.content)} bytes, "
+                      f"Content-Encoding: {response.headers.get('Content-Encoding', 'none')}")
+        return response
+
+    def _with_rate_limit(self, send: Callable[[], Optional[requests.Response]],
+                         url: str) -> Optional[requests.Response]:
+        """Call send, backing off and retrying while the response is HTTP 429."""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            response = send()
+            if response is None or response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+                return response
+            delay = _rate_limit_delay(response, attempt)
+            self._log(f"Rate limited on {url}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _send(self, client_id: str, url: str, body: bytes) -> Optional[requests.Response]:
+        """Send one POST, logging in again once if the token is rejected."""
+        session = self.get_session(client_id)
+        if not session:
+            return None
+        
+        response = session.post(url, data=body, timeout=30)
+        if response.status_code == 401:
+            # Cached token was revoked or expired early
+            self._log(f"Token for {client_id} rejected, re-authenticating")
+            self._invalidate_session(client_id, session)
+            session = self.get_session(client_id)
+            if not session:
+                return None
+            response = session.post(url, data=body, timeout=30)
+        return response
+
+    def get_organizational_units(self) -> List[Dict]:
+        """
+        Get all organizational units.
+        
+        Returns:
+            List of OU dictionaries with id, name, parentID
+        """
+        self._log("Retrieving organizational units")
+        
+        try:
+            response = self._post("organization", self.org_units_url, {})
+            if response is None:
+                return []
+            response.raise_for_status()
+            
+            data = _json_loads(response.content)
+            if data.get('status') == 0:
+                org_units = data.get('organizationUnits', {}).get('orgUnits', [])
+                self._log(f"Found {len(org_units)} organizational units")
+                return org_units
+            else:
+                print(f"ERROR: API returned status {data.get('status')}: {data.get('message')}")
+                return []
+                
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"ERROR: Failed to get organizational units: {e}")
+            return []
+
+    def get_accounts_for_ou(self, ou_id: int) -> List[Dict]:
+        """
+        Get all accounts for a specific OU.
+        
+        Args:
+            ou_id: Organizational unit ID
+        
+        Returns:
+            List of account dictionaries
+        """
+        cached = self._accounts_cache.get(ou_id)
+        if cached is not None:
+            return cached
+        
+        self._log(f"Retrieving accounts for OU {ou_id}")
+        
+        try:
+            response = self._post("iam", self.iam_accounts_url, {"parentId": ou_id})
+            if response is None:
+                return []
+            response.raise_for_status()
+            
+            data = _json_loads(response.content)
+            if data.get('status') == 0:
+                accounts = data.get('accounts', [])
+                self._log(f"Found {len(accounts)} accounts in OU {ou_id}")
+                self._accounts_cache[ou_id] = accounts
+                return accounts
+            else:
+                print(f"ERROR: API returned status {data.get('status')}: {data.get('message')}")
+                return []
+                
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"ERROR: Failed to get accounts for OU {ou_id}: {e}")
+            return []
+
+    def _list_products(self, payload: bytes) -> Optional[Dict]:
+        """POST one products/list request and return the decoded response body."""
+        response = self._post("assetmanagement", self.products_url, payload)
+        if response is None:
+            return None
+        response.raise_for_status()
+        return _json_loads(response.content)
+
+    def _list_products_page(self, payload: bytes) -> Dict:
+        """
+        Fetch one extra products/list page.
+        
+        Errors are returned as a response body with a None status instead of
+        raised, so one failed page does not discard the rest of the account.
+        """
+        try:
+            data = self._list_products(payload)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return {"status": None, "message": str(e)}
+        if data is None:
+            return {"status": None, "message": "authentication failed"}
+        return data
+
+    def get_devices_for_account(self, account_id: int, serial_pattern: str,
+                                model_prefix: Union[str, Tuple[str, ...], None] = None) -> List[Dict]:
+        """
+        Get all devices for an account matching serial pattern.
+        
+        Args:
+            account_id: Account ID
+            serial_pattern: Serial number pattern to match (e.g., "F" or "S")
+            model_prefix: Optional productModel prefix (or tuple of prefixes);
+                other devices are dropped before the list is returned
+        
+        Returns:
+            List of device dictionaries
+        """
+        self._log(f"Retrieving devices for account {account_id} with pattern '{serial_pattern}'")
+        
+        payload = _products_payload_template(serial_pattern) % int(account_id)
+        
+        try:
+            data = self._list_products(payload)
+            if data is None:
+                return []
+            
+            if data.get('status') == 0:
+                devices = data.get('assets', [])
+                if devices is None:
+                    devices = []
+                
+                # Large accounts span several pages; once page 1 reports the
+                # total, fetch the rest concurrently and append them in order.
+                # An empty first page means a stale total, so nothing more to fetch
+                total_pages = int(data.get('totalPages') or 1)
+                if total_pages > 1 and devices:
+                    self._log(f"Account {account_id} has {total_pages} pages of devices")
+                    pages = range(2, total_pages + 1)
+                    page_payloads = [payload[:-1] + b',"pageNumber":%d}' % page for page in pages]
+                    page_results = self._page_executor.map(self._list_products_page, page_payloads)
+                    for page, page_data in zip(pages, page_results):
+                        if page_data.get('status') == 0:
+                            devices.extend(page_data.get('assets') or [])
+                        else:
+                            print(f"ERROR: Failed to get page {page}/{total_pages} of devices for "
+                                  f"account {account_id}: status {page_data.get('status')}: "
+                                  f"{page_data.get('message')}")
+                
+                if model_prefix:
+                    # Skips devices with a missing or null productModel without
+                    # building a default string for each of them
+                    devices = [d for d in devices
+                               if (model := d.get('productModel')) and model.startswith(model_prefix)]
+                self._log(f"Found {len(devices)} devices for account {account_id}")
+                return devices
+            else:
+                # Status != 0 might just mean no devices found
+                if data.get('status') != 1008:  # 1008 = No records found
+                    self._log(f"API returned status {data.get('status')}: {data.get('message')}")
+                return []
+                
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"ERROR: Failed to get devices for account {account_id}: {e}")
+            return []
+
+
+def discover_all_accounts(api: FortiCloudAPI) -> Dict[int, Dict]:
+    """
+    Discover all accounts across all OUs.
+    
+    Returns:
+        Dictionary mapping account_id to account metadata
+    """
+    print("Discovering organizational structure...")
+    
+    # The three service logins are independent; run them concurrently
+    # instead of one per step as each API is first used
+    api.map(api.get_session, ('organization', 'iam', 'assetmanagement'))
+    
+    ous = api.get_organizational_units()
+    if not ous:
+        print("ERROR: No organizational units found")
+        return {}
+    
+    print(f"Found {len(ous)} organizational units")
+    
+    accounts_map = {}
+    
+    # Query each distinct OU concurrently; OUs are still walked in order
+    # below so the first OU listing an account still wins
+    ou_ids = list(dict.fromkeys(ou.get('id') for ou in ous))
+    accounts_by_ou = dict(zip(ou_ids, api.map(api.get_accounts_for_ou, ou_ids)))
+    
+    for ou in ous:
+        ou_id = ou.get('id')
+        ou_name = ou.get('name', 'Unknown')
+        accounts = accounts_by_ou[ou_id]
+        
+        print(f"  Queried accounts in OU: {ou_name} (ID: {ou_id})")
+        
+        for account in accounts:
+            account_id = account.get('id')
+            if account_id and account_id not in accounts_map:
+                accounts_map[account_id] = {
+                    'id': account_id,
+                    'company': account.get('company', ''),
+                    'email': account.get('email', ''),
+                    'ou_name': ou_name,
+                    'ou_id': ou_id
+                }
+        
+        print(f"    Found {len(accounts)} accounts")
+    
+    print(f"\nTotal unique accounts discovered: {len(accounts_map)}")
+    return accounts_map
+
+
+def flatten_device_data(device: Dict, asset_type: str) -> Tuple:
+    """
+    Flatten device data for CSV export with comparable fields to other systems.
+    
+    Args:
+        device: Device dictionary from API
+        asset_type: Value for the Asset Type column (e.g., "Firewall")
+    
+    Returns:
+        CSV row with values in FIELDNAMES order
+    """
+    get = device.get
+    
+    # Extract primary contract (first contract if exists)
+    contracts = get('contracts', [])
+    primary_contract = contracts[0] if contracts else {}
+    
+    # Extract primary contract term (first term if exists)
+    terms = primary_contract.get('terms', [])
+    primary_term = terms[0] if terms else {}
+    
+    # Extract primary entitlement (first entitlement if exists)
+    entitlements = get('entitlements', [])
+    primary_entitlement = entitlements[0] if entitlements else {}
+    
+    # Bound lookups for the nested records, each read several times below
+    contract_get = primary_contract.get
+    term_get = primary_term.get
+    entitlement_get = primary_entitlement.get
+    
+    # Values used in more than one column
+    description = get('description', '')
+    status = get('status', '')
+    decommissioned = 'Yes' if get('isDecommissioned') else 'No'
+    folder_id = get('folderId')
+    account_id = get('accountId')
+    account_ou_id = get('account_ou_id')
+    registration_date = format_date(get('registrationDate'))
+    
+    # Unified 60-field structure, keys in FIELDNAMES order
+    row = {
+        # Section 1: Core Identification
+        'Serial Number': get('serialNumber', ''),
+        'Device Name': description,
+        'Hostname': '',
+        'Model': get('productModel', ''),
+        'Description': description,
+        'Asset Type': asset_type,
+        'Source System': 'FortiCloud',
+        
+        # Section 2: Network & Connection
+        'Management IP': '',
+        'Connection Status': status,
+        'Management Mode': '',
+        'Firmware Version': '',
+        
+        # Section 3: Organization & Location
+        'Company': get('account_company', ''),
+        'Organizational Unit': get('account_ou_name', ''),
+        'Branch': '',
+        'Location': '',
+        'Folder Path': get('folderPath', ''),
+        'Folder ID': str(folder_id) if folder_id else '',
+        'Vendor': 'Fortinet',
+        
+        # Section 4: Contract Information
+        'Contract Number': contract_get('contractNumber', ''),
+        'Contract SKU': contract_get('sku', ''),
+        'Contract Type': '',
+        'Contract Summary': '',
+        'Contract Start Date': format_date(term_get('startDate')),
+        'Contract Expiration Date': format_date(term_get('endDate')),
+        'Contract Status': 'OPERATIONAL' if status == 'Registered' else '',
+        'Contract Support Type': term_get('supportType', ''),
+        'Contract Archived': 'No',
+        
+        # Section 5: Entitlement Information
+        'Entitlement Level': entitlement_get('levelDesc', ''),
+        'Entitlement Type': entitlement_get('typeDesc', ''),
+        'Entitlement Start Date': format_date(entitlement_get('startDate')),
+        'Entitlement End Date': format_date(entitlement_get('endDate')),
+        
+        # Section 6: Lifecycle & Status
+        'Status': status,
+        'Is Decommissioned': decommissioned,
+        'Archived': decommissioned,
+        'Registration Date': registration_date,
+        'Product EoR': format_date(get('productModelEoR')),
+        'Product EoS': format_date(get('productModelEoS')),
+        'Last Updated': registration_date,
+        
+        # Section 7: Account Information
+        'Account ID': str(account_id) if account_id else '',
+        'Account Email': get('account_email', ''),
+        'Account OU ID': str(account_ou_id) if account_ou_id else '',
+        
+        # Section 8: FortiGate-Specific Fields (empty for FortiCloud)
+        'HA Mode': '',
+        'HA Cluster Name': '',
+        'HA Role': '',
+        'HA Member Status': '',
+        'HA Priority': '',
+        'Max VDOMs': '',
+        
+        # Section 9: FortiSwitch/FortiAP Parent Tracking (empty)
+        'Parent FortiGate': '',
+        'Parent FortiGate Serial': '',
+        'Parent FortiGate Platform': '',
+        'Parent FortiGate IP': '',
+        
+        # Section 10: FortiSwitch-Specific Fields (empty)
+        'Device Type': '',
+        'Max PoE Budget': '',
+        'Join Time': '',
+        
+        # Section 11: FortiAP-Specific Fields (empty)
+        'Board MAC': '',
+        'Admin Status': '',
+        'Client Count': '',
+        'Mesh Uplink': '',
+        'WTP Mode': '',
+        'VDOM': ''
+    }
+    return tuple(row.values())
+
+
+@lru_cache(maxsize=4096)
+def format_date(date_str: Optional[str]) -> str:
+    """
+    Format date string to YYYY-MM-DD.
+    
+    Results are cached, as many devices share contract and entitlement dates.
+    
+    Args:
+        date_str: Date string in ISO format (e.g., "2023-05-15T10:20:30")
+    
+    Returns:
+        Formatted date string or empty string if invalid
+    """
+    if not date_str:
+        return ''
+    
+    # Fast path: "YYYY-MM-DDThh:mm:ss..." already starts with the date part, and
+    # formatting never shifts time zones, so slicing matches a full parse
+    if date_str[10:11] == 'T' and date_str[4:5] == '-' and date_str[7:8] == '-' and date_str[:4].isdigit():
+        return date_str[:10]
+    
+    try:
+        # Handle ISO format with time (fromisoformat accepts a trailing "Z"
+        # natively on the supported Python versions)
+        if 'T' in date_str:
+            dt = datetime.fromisoformat(date_str)
+            return dt.strftime('%Y-%m-%d')
+        # Handle date-only format
+        else:
+            return date_str.split(' ')[0]  # Take date part only
+    except (ValueError, AttributeError):
+        return date_str  # Return as-is if parsing fails
+
+
+def export_to_csv(devices: Iterable[Dict], output_file: str, asset_type: str) -> int:
+    """
+    Export devices to CSV file.
+    
+    Rows are flattened and written one device at a time, so any iterable of
+    devices (including a generator) is streamed without holding a second copy.
+    
+    Args:
+        devices: Device dictionaries from the API
+        output_file: Path to output CSV file
+        asset_type: Value for the Asset Type column
+    
+    Returns:
+        Number of devices written
+    """
+    devices = iter(devices)
+    first = next(devices, None)
+    if first is None:
+        print("No devices to export")
+        return 0
+    
+    count = 0
+    try:
+        with open(output_file, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE) as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDNAMES)
+            writer.writerow(flatten_device_data(first, asset_type))
+            count = 1
+            for device in devices:
+                writer.writerow(flatten_device_data(device, asset_type))
+                count += 1
+        
+        print(f"\nSuccessfully exported {count} devices to: {output_file}")
+        
+    except IOError as e:
+        print(f"ERROR: Failed to write CSV file: {e}")
+    
+    return count
+
+
+def load_credentials() -> Dict[str, str]:
+    """
+    Load FortiCloud credentials from environment or .env file.
+    
+    Returns:
+        Dictionary with credentials
+    """
+    load_dotenv()
+    
+    username = os.getenv('FORTICLOUD_USERNAME') or os.getenv('FORTICLOUD_CLIENT_ID')
+    password = os.getenv('FORTICLOUD_PASSWORD') or os.getenv('FORTICLOUD_CLIENT_SECRET')
+    auth_url = os.getenv('FORTICLOUD_AUTH_URL')
+    api_base_url = os.getenv('FORTICLOUD_API_BASE_URL') or DEFAULT_API_BASE_URL
+    
+    if not all([username, password, auth_url]):
+        print("ERROR: Missing required environment variables:")
+        if not username:
+            print("  - FORTICLOUD_USERNAME (or FORTICLOUD_CLIENT_ID)")
+        if not password:
+            print("  - FORTICLOUD_PASSWORD (or FORTICLOUD_CLIENT_SECRET)")
+        if not auth_url:
+            print("  - FORTICLOUD_AUTH_URL")
+        print("\nPlease set these in your .env file or environment.")
+        sys.exit(1)
+    
+    # Check the URLs once here instead of failing on the first request
+    for name, url in (('FORTICLOUD_AUTH_URL', auth_url), ('FORTICLOUD_API_BASE_URL', api_base_url)):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            print(f"ERROR: {name} is not a valid http(s) URL: {url}")
+            sys.exit(1)
+    
+    return {
+        'username': username,
+        'password': password,
+        'auth_url': auth_url,
+        'api_base_url': api_base_url
+    }
@@ -7,18 +7,118 @@ and exports them to a CSV file with contract information including dates.
 """
 
 import os
+import re
 import csv
 import requests
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from typing import List, Dict, Optional
+from urllib3.util.retry import Retry
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 from datetime import datetime
 
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:  # Fall back to the standard library if orjson isn't installed
+    import json
+
+    _json_loads = json.loads
+
+# Concurrent TopDesk requests while looking up linked contracts
+MAX_WORKERS = 16
+
+# Write buffer for CSV output, so large exports use few write() calls
+CSV_BUFFER_SIZE = 1 << 20
+
+# Device count from which flattening is spread over worker processes, and
+# devices per worker task; below the threshold, pickling records to the
+# workers costs more than the parallelism saves
+FLATTEN_PROCESS_THRESHOLD = 20000
+FLATTEN_CHUNK_SIZE = 2000
+
+# Fortinet serial numbers, and the serial embedded in "SUP.[...]<serial>" contract names
+_SERIAL_RE = re.compile(r'\b(FP[A-Z0-9]{6,}|FAP[A-Z0-9]{6,}|F\d{3}[A-Z]{2}[A-Z0-9]{6,})\b', re.IGNORECASE)
+_SUP_RE = re.compile(r'SUP\.(?:[A-Z0-9]+\.)?([A-Z0-9]{8,})', re.IGNORECASE)
+
+# Link types that count as a support contract
+_CONTRACT_RE = re.compile(r'support|contract|license', re.IGNORECASE)
+
+# Asset types that can hold access points
+_AP_TYPE_RE = re.compile(r'access point|wap|wireless', re.IGNORECASE)
+
+# Common FortiAP model numbers (112, 221, ..., 433) anywhere in the summary;
+# this also covers the "FAP-231" and "U231F" spellings
+_FORTIAP_MODEL_RE = re.compile(r'112|22[134]|23[134]|32[13]|33[12]|43[123]')
+
+# Unified 60-field structure - same order for all systems
+FIELDNAMES = (
+    # Section 1: Core Identification
+    'Serial Number', 'Device Name', 'Hostname', 'Model', 'Description',
+    'Asset Type', 'Source System',
+
+    # Section 2: Network & Connection
+    'Management IP', 'Connection Status', 'Management Mode', 'Firmware Version',
+
+    # Section 3: Organization & Location
+    'Company', 'Organizational Unit', 'Branch', 'Location',
+    'Folder Path', 'Folder ID', 'Vendor',
+
+    # Section 4: Contract Information
+    'Contract Number', 'Contract SKU', 'Contract Type', 'Contract Summary',
+    'Contract Start Date', 'Contract Expiration Date', 'Contract Status',
+    'Contract Support Type', 'Contract Archived',
+
+    # Section 5: Entitlement Information
+    'Entitlement Level', 'Entitlement Type',
+    'Entitlement Start Date', 'Entitlement End Date',
+
+    # Section 6: Lifecycle & Status
+    'Status', 'Is Decommissioned', 'Archived', 'Registration Date',
+    'Product EoR', 'Product EoS', 'Last Updated',
+
+    # Section 7: Account Information
+    'Account ID', 'Account Email', 'Account OU ID',
+
+    # Section 8: FortiGate-Specific Fields
+    'HA Mode', 'HA Cluster Name', 'HA Role', 'HA Member Status',
+    'HA Priority', 'Max VDOMs',
+
+    # Section 9: FortiSwitch/FortiAP Parent Tracking
+    'Parent FortiGate', 'Parent FortiGate Serial',
+    'Parent FortiGate Platform', 'Parent FortiGate IP',
+
+    # Section 10: FortiSwitch-Specific Fields
+    'Device Type', 'Max PoE Budget', 'Join Time',
+
+    # Section 11: FortiAP-Specific Fields
+    'Board MAC', 'Admin Status', 'Client Count', 'Mesh Uplink',
+    'WTP Mode', 'VDOM'
+)
+
+# Row template: every field empty except the values shared by all FortiAP
+# rows; copied and filled in per device/contract
+_ROW_TEMPLATE = dict.fromkeys(FIELDNAMES, '')
+_ROW_TEMPLATE.update({
+    'Asset Type': 'Access Point',
+    'Source System': 'TopDesk'
+})
+
 
 class TopDeskAPI:
     def __init__(self, base_url: str, username: str, password: str, debug: bool = False):
         """Initialize TopDesk API client."""
         self.base_url = base_url.rstrip('/') + '/tas/api/assetmgmt'
         self.session = requests.Session()
+        # Keep one pooled keep-alive connection per worker thread, and retry
+        # throttled (429) or failing requests with backoff, honouring Retry-After
+        adapter = HTTPAdapter(
+            pool_maxsize=MAX_WORKERS,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.auth = HTTPBasicAuth(username, password)
         self.session.headers.update({
             'Accept': 'application/x.topdesk-am-assets-v2+json',
@@ -50,10 +150,12 @@ class TopDeskAPI:
                 'templateName': template_name,
                 'pageSize': page_size,
                 'pageStart': page_start,
-                'fields': 'name,@type,@@summary,@assignments,@status,modificationDate,creationDate,serienummer,model,ip-address,host-name,software-versie,vendor,environment-1,aanschafdatum'
+                # Only the fields filter_fortiap_devices and flatten_device_data read
+                'fields': 'name,@type,@@summary,@assignments,@status,modificationDate,serienummer,model,ip-address,host-name,software-versie,vendor'
             }
 
-            self._log(f"Request: GET /assets with params: {params}")
+            if self.debug:  # Skip building the message when it would be discarded
+                self._log(f"Request: GET /assets with params: {params}")
 
             try:
                 response = self.session.get(
@@ -63,22 +165,21 @@ class TopDeskAPI:
                 )
                 response.raise_for_status()
 
-                data = response.json()
+                data = _json_loads(response.content)
                 assets = data.get('dataSet', [])
 
-                if not assets:
-                    break
-
                 all_assets.extend(assets)
-                self._log(f"Retrieved {len(assets)} assets (total: {len(all_assets)})")
+                if self.debug:
+                    self._log(f"Retrieved {len(assets)} assets (total: {len(all_assets)})")
 
-                # Check if there are more results
-                if len(assets) < page_size:
+                # TopDesk answers 206 only while more results remain; a 200 or a
+                # short page is the last one, so stop without requesting an empty page
+                if len(assets) < page_size or response.status_code != 206:
                     break
 
                 page_start += page_size
 
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, ValueError) as e:
                 print(f"ERROR: Request failed: {e}")
                 raise
 
@@ -103,14 +204,33 @@ class TopDeskAPI:
             )
             response.raise_for_status()
 
-            links = response.json()
-            self._log(f"Found {len(links)} linked assets for {asset_unid}")
+            links = _json_loads(response.content)
+            if self.debug:
+                self._log(f"Found {len(links)} linked assets for {asset_unid}")
             return links
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             self._log(f"Failed to retrieve linked assets for {asset_unid}: {e}")
             return []
 
+    def get_linked_assets_bulk(self, asset_unids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        Get linked assets for many assets at once.
+
+        TopDesk has no bulk assetLinks query and link entries do not name
+        their source, so each distinct asset is still one request; those
+        requests are issued concurrently.
+
+        Args:
+            asset_unids: UUIDs of the source assets
+
+        Returns:
+            Dictionary mapping each UUID to its linked asset dictionaries
+        """
+        unique_unids = list(dict.fromkeys(asset_unids))
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            return dict(zip(unique_unids, executor.map(self.get_linked_assets, unique_unids)))
+
     def get_asset_detail(self, asset_id: str) -> Optional[Dict]:
         """
         Get full details of a specific asset including all custom fields.
@@ -129,9 +249,9 @@ class TopDeskAPI:
             )
             response.raise_for_status()
 
-            return response.json()
+            return _json_loads(response.content)
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             self._log(f"Failed to retrieve asset detail for {asset_id}: {e}")
             return None
 
@@ -149,8 +269,10 @@ def load_config():
         with open(config_file, 'r') as f:
             for line in f:
                 line = line.strip()
-                if line and '=' in line and not line.startswith('#'):
-                    key, value = line.split('=', 1)
+                if not line or line.startswith('#'):
+                    continue
+                key, sep, value = line.partition('=')
+                if sep:
                     config[key.strip()] = value.strip()
 
         return {
@@ -184,26 +306,16 @@ def filter_fortiap_devices(assets: List[Dict]) -> List[Dict]:
     fortiap_devices = []
     
     for asset in assets:
-        summary = asset.get('@@summary', '').lower()
-        name = asset.get('name', '').lower()
-        type_name = asset.get('@type', {}).get('name', '').lower()
-
-        if not ('access point' in type_name or 'wap' in type_name or 'wireless' in type_name):
+        type_name = asset.get('@type', {}).get('name', '')
+        if not _AP_TYPE_RE.search(type_name):
             continue
 
-        is_fortiap = any([
-            'fortiap' in summary,
-            'fortinet' in summary and 'fap-' in summary,
-            'fortinet' in summary and 'fap' in summary.split(),
-            any(model in summary for model in [
-                '112', '221', '223', '224', '231', '233', '234',
-                '321', '323', '331', '332', '431', '432', '433',
-                'fap-112', 'fap-221', 'fap-223', 'fap-224',
-                'fap-231', 'fap-233', 'fap-234', 'fap-321',
-                'fap-323', 'fap-331', 'fap-332', 'fap-431',
-                'fap-432', 'fap-433', 'u231f', 'u234f', 'u431f'
-            ])
-        ])
+        summary = asset.get('@@summary', '').lower()
+        is_fortiap = (
+            'fortiap' in summary
+            or ('fortinet' in summary and ('fap-' in summary or 'fap' in summary.split()))
+            or _FORTIAP_MODEL_RE.search(summary) is not None
+        )
 
         if is_fortiap:
             fortiap_devices.append(asset)
@@ -224,49 +336,61 @@ def enrich_with_contracts(api: TopDeskAPI, devices: List[Dict]) -> List[Dict]:
     """
     print("Retrieving support contracts for devices...")
 
-    for i, device in enumerate(devices, 1):
-        if i % 10 == 0:
-            print(f"  Processed {i}/{len(devices)} devices...")
+    # Linked assets for every device, fetched up front in one batch
+    links_by_unid = api.get_linked_assets_bulk([device['unid'] for device in devices if device.get('unid')])
 
-        asset_unid = device.get('unid')
-        if not asset_unid:
-            continue
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        device_links = []
+        for i, device in enumerate(devices, 1):
+            if i % 10 == 0:
+                print(f"  Processed {i}/{len(devices)} devices...")
 
-        linked_assets = api.get_linked_assets(asset_unid)
-
-        contracts = []
-        for link in linked_assets:
-            if 'support' in link.get('type', '').lower() or 'contract' in link.get('type', '').lower() or 'license' in link.get('type', '').lower():
-                contract_id = link.get('assetId')
-                if contract_id:
-                    contract_detail = api.get_asset_detail(contract_id)
-                    if contract_detail and 'data' in contract_detail:
-                        data = contract_detail['data']
-                        contracts.append({
-                            'name': link.get('name', 'N/A'),
-                            'type': link.get('type', 'N/A'),
-                            'summary': link.get('summary', 'N/A'),
-                            'status': link.get('status', 'N/A'),
-                            'archived': link.get('archived', False),
-                            'start_date': data.get('aanschafdatum', 'N/A'),
-                            'expiration_date': data.get('vervaldatum', 'N/A'),
-                            'vendor_id': data.get('vendor', 'N/A'),
-                            'contract_type_id': data.get('contract-type', 'N/A')
-                        })
-                    else:
-                        contracts.append({
-                            'name': link.get('name', 'N/A'),
-                            'type': link.get('type', 'N/A'),
-                            'summary': link.get('summary', 'N/A'),
-                            'status': link.get('status', 'N/A'),
-                            'archived': link.get('archived', False),
-                            'start_date': 'N/A',
-                            'expiration_date': 'N/A',
-                            'vendor_id': 'N/A',
-                            'contract_type_id': 'N/A'
-                        })
-
-        device['contracts'] = contracts
+            asset_unid = device.get('unid')
+            if not asset_unid:
+                continue
+
+            linked_assets = links_by_unid[asset_unid]
+            contract_links = [
+                link for link in linked_assets
+                if link.get('assetId') and _CONTRACT_RE.search(link.get('type', ''))
+            ]
+            device_links.append((device, contract_links))
+
+        # Then each distinct contract's details, once, again concurrently
+        contract_ids = list(dict.fromkeys(link['assetId'] for _, links in device_links for link in links))
+        contract_details = dict(zip(contract_ids, executor.map(api.get_asset_detail, contract_ids)))
+
+        for device, links in device_links:
+            contracts = []
+            for link in links:
+                contract_detail = contract_details[link['assetId']]
+                if contract_detail and 'data' in contract_detail:
+                    data = contract_detail['data']
+                    contracts.append({
+                        'name': link.get('name', 'N/A'),
+                        'type': link.get('type', 'N/A'),
+                        'summary': link.get('summary', 'N/A'),
+                        'status': link.get('status', 'N/A'),
+                        'archived': link.get('archived', False),
+                        'start_date': data.get('aanschafdatum', 'N/A'),
+                        'expiration_date': data.get('vervaldatum', 'N/A'),
+                        'vendor_id': data.get('vendor', 'N/A'),
+                        'contract_type_id': data.get('contract-type', 'N/A')
+                    })
+                else:
+                    contracts.append({
+                        'name': link.get('name', 'N/A'),
+                        'type': link.get('type', 'N/A'),
+                        'summary': link.get('summary', 'N/A'),
+                        'status': link.get('status', 'N/A'),
+                        'archived': link.get('archived', False),
+                        'start_date': 'N/A',
+                        'expiration_date': 'N/A',
+                        'vendor_id': 'N/A',
+                        'contract_type_id': 'N/A'
+                    })
+
+            device['contracts'] = contracts
 
     print(f"  Completed contract retrieval for {len(devices)} devices")
     return devices
@@ -276,36 +400,33 @@ def format_date(date_str: str) -> str:
     """Format TopDesk date string to YYYY-MM-DD format."""
     if not date_str or date_str == 'N/A':
         return 'N/A'
-    
-    try:
-        return date_str.split('T')[0]
-    except:
+    if not isinstance(date_str, str):
         return date_str
+    
+    # Date part of an ISO timestamp; strings without a time pass through
+    t = date_str.find('T')
+    return date_str[:t] if t >= 0 else date_str
 
 
 def extract_serial_from_text(text: str) -> Optional[str]:
     """Extract Fortinet serial number from text."""
-    import re
-    
-    matches = re.findall(r'\b(FP[A-Z0-9]{6,}|FAP[A-Z0-9]{6,}|F\d{3}[A-Z]{2}[A-Z0-9]{6,})\b', text, re.IGNORECASE)
-    if matches:
-        return matches[0]
+    # Only the first match is used, so search() instead of findall()
+    match = _SERIAL_RE.search(text)
+    if match:
+        return match.group(1)
     
-    sup_matches = re.findall(r'SUP\.(?:[A-Z0-9]+\.)?([A-Z0-9]{8,})', text, re.IGNORECASE)
-    if sup_matches:
-        return sup_matches[0]
+    sup_match = _SUP_RE.search(text)
+    if sup_match:
+        return sup_match.group(1)
     
     return None
 
 
-def flatten_device_data(devices: List[Dict]) -> List[Dict]:
-    """Flatten device data for CSV export."""
-    flattened = []
-
+def flatten_device_data(devices: List[Dict]) -> Iterator[Tuple]:
+    """Flatten device data for CSV export, yielding one row (in FIELDNAMES order) at a time."""
     for device in devices:
         name = device.get('name', 'N/A')
         summary = device.get('@@summary', 'N/A')
-        type_name = device.get('@type', {}).get('name', 'N/A')
         status = device.get('@status', 'N/A')
         archived = device.get('archived', False)
         mod_date = device.get('modificationDate', 'N/A')
@@ -317,9 +438,6 @@ def flatten_device_data(devices: List[Dict]) -> List[Dict]:
         hostname_td = device.get('host-name', '') or ''
         firmware_td = device.get('software-versie', '') or ''
         vendor_td = device.get('vendor', '') or ''
-        environment_td = device.get('environment-1', '') or ''
-        creation_date_td = device.get('creationDate', '') or ''
-        purchase_date_td = device.get('aanschafdatum', '') or ''
 
         # Use vendor from TopDesk field if available, otherwise parse from summary
         vendor = vendor_td if vendor_td else ('Fortinet' if 'fortinet' in summary.lower() else 'Unknown')
@@ -330,12 +448,11 @@ def flatten_device_data(devices: List[Dict]) -> List[Dict]:
         # If model field is empty, try to extract from summary
         if not model:
             summary_parts = summary.split()
-            for part in summary_parts:
-                if 'ap' in part.lower() or 'fap' in part.lower():
-                    idx = summary_parts.index(part)
-                    if idx + 1 < len(summary_parts):
-                        model = summary_parts[idx] + ' ' + summary_parts[idx + 1]
-                        break
+            # Any token containing "fap" also contains "ap", so one check covers both
+            for idx, part in enumerate(summary_parts[:-1]):
+                if 'ap' in part.lower():
+                    model = part + ' ' + summary_parts[idx + 1]
+                    break
         
         if not model:
             model = 'Unknown'
@@ -371,224 +488,99 @@ def flatten_device_data(devices: List[Dict]) -> List[Dict]:
         if not serial_number:
             serial_number = extract_serial_from_text(summary) or extract_serial_from_text(name) or 'N/A'
 
-        # Build unified 60-field structure
-        if contracts:
-            # Create a row for each contract
-            for contract in contracts:
-                row = {
-                    # Section 1: Core Identification
-                    'Serial Number': serial_number,
-                    'Device Name': name,
-                    'Hostname': hostname_td or name,
-                    'Model': model,
-                    'Description': summary,
-                    'Asset Type': 'Access Point',
-                    'Source System': 'TopDesk',
-                    
-                    # Section 2: Network & Connection
-                    'Management IP': ip_address_td or '',
-                    'Connection Status': status,
-                    'Management Mode': '',
-                    'Firmware Version': firmware_td or '',
-                    
-                    # Section 3: Organization & Location
-                    'Company': '',
-                    'Organizational Unit': '',
-                    'Branch': branch_name if branch_name != 'N/A' else '',
-                    'Location': location_name if location_name != 'N/A' else '',
-                    'Folder Path': '',
-                    'Folder ID': '',
-                    'Vendor': vendor,
-                    
-                    # Section 4: Contract Information
-                    'Contract Number': contract.get('name', ''),
-                    'Contract SKU': '',
-                    'Contract Type': contract.get('type', ''),
-                    'Contract Summary': contract.get('summary', ''),
-                    'Contract Start Date': format_date(contract.get('start_date', '')),
-                    'Contract Expiration Date': format_date(contract.get('expiration_date', '')),
-                    'Contract Status': contract.get('status', ''),
-                    'Contract Support Type': '',
-                    'Contract Archived': 'Yes' if contract.get('archived', False) else 'No',
-                    
-                    # Section 5: Entitlement Information (empty)
-                    'Entitlement Level': '',
-                    'Entitlement Type': '',
-                    'Entitlement Start Date': '',
-                    'Entitlement End Date': '',
-                    
-                    # Section 6: Lifecycle & Status
-                    'Status': status,
-                    'Is Decommissioned': '',
-                    'Archived': 'Yes' if archived else 'No',
-                    'Registration Date': '',
-                    'Product EoR': '',
-                    'Product EoS': '',
-                    'Last Updated': mod_date,
-                    
-                    # Section 7: Account Information (empty)
-                    'Account ID': '',
-                    'Account Email': '',
-                    'Account OU ID': '',
-                    
-                    # Section 8: FortiGate-Specific Fields (empty)
-                    'HA Mode': '',
-                    'HA Cluster Name': '',
-                    'HA Role': '',
-                    'HA Member Status': '',
-                    'HA Priority': '',
-                    'Max VDOMs': '',
-                    
-                    # Section 9: FortiSwitch/FortiAP Parent Tracking (empty)
-                    'Parent FortiGate': '',
-                    'Parent FortiGate Serial': '',
-                    'Parent FortiGate Platform': '',
-                    'Parent FortiGate IP': '',
-                    
-                    # Section 10: FortiSwitch-Specific Fields (empty)
-                    'Device Type': '',
-                    'Max PoE Budget': '',
-                    'Join Time': '',
-                    
-                    # Section 11: FortiAP-Specific Fields (empty)
-                    'Board MAC': '',
-                    'Admin Status': '',
-                    'Client Count': '',
-                    'Mesh Uplink': '',
-                    'WTP Mode': '',
-                    'VDOM': ''
-                }
-                flattened.append(row)
-        else:
+        # Device fields shared by every row of this device; the rest of the
+        # unified 60-field structure stays empty
+        base_row = _ROW_TEMPLATE.copy()
+        base_row.update({
+            # Section 1: Core Identification
+            'Serial Number': serial_number,
+            'Device Name': name,
+            'Hostname': hostname_td or name,
+            'Model': model,
+            'Description': summary,
+
+            # Section 2: Network & Connection
+            'Management IP': ip_address_td or '',
+            'Connection Status': status,
+            'Firmware Version': firmware_td or '',
+
+            # Section 3: Organization & Location
+            'Branch': branch_name if branch_name != 'N/A' else '',
+            'Location': location_name if location_name != 'N/A' else '',
+            'Vendor': vendor,
+
+            # Section 6: Lifecycle & Status
+            'Status': status,
+            'Archived': 'Yes' if archived else 'No',
+            'Last Updated': mod_date
+        })
+
+        if not contracts:
             # Create a single row without contract
-            row = {
-                # Section 1: Core Identification
-                'Serial Number': serial_number,
-                'Device Name': name,
-                'Hostname': hostname_td or name,
-                'Model': model,
-                'Description': summary,
-                'Asset Type': 'Access Point',
-                'Source System': 'TopDesk',
-                
-                # Section 2: Network & Connection
-                'Management IP': ip_address_td or '',
-                'Connection Status': status,
-                'Management Mode': '',
-                'Firmware Version': firmware_td or '',
-                
-                # Section 3: Organization & Location
-                'Company': '',
-                'Organizational Unit': '',
-                'Branch': branch_name if branch_name != 'N/A' else '',
-                'Location': location_name if location_name != 'N/A' else '',
-                'Folder Path': '',
-                'Folder ID': '',
-                'Vendor': vendor,
-                
-                # Section 4: Contract Information (empty)
-                'Contract Number': '',
-                'Contract SKU': '',
-                'Contract Type': '',
-                'Contract Summary': '',
-                'Contract Start Date': '',
-                'Contract Expiration Date': '',
-                'Contract Status': '',
-                'Contract Support Type': '',
-                'Contract Archived': '',
-                
-                # Section 5: Entitlement Information (empty)
-                'Entitlement Level': '',
-                'Entitlement Type': '',
-                'Entitlement Start Date': '',
-                'Entitlement End Date': '',
-                
-                # Section 6: Lifecycle & Status
-                'Status': status,
-                'Is Decommissioned': '',
-                'Archived': 'Yes' if archived else 'No',
-                'Registration Date': '',
-                'Product EoR': '',
-                'Product EoS': '',
-                'Last Updated': mod_date,
-                
-                # Section 7: Account Information (empty)
-                'Account ID': '',
-                'Account Email': '',
-                'Account OU ID': '',
-                
-                # Section 8: FortiGate-Specific Fields (empty)
-                'HA Mode': '',
-                'HA Cluster Name': '',
-                'HA Role': '',
-                'HA Member Status': '',
-                'HA Priority': '',
-                'Max VDOMs': '',
-                
-                # Section 9: FortiSwitch/FortiAP Parent Tracking (empty)
-                'Parent FortiGate': '',
-                'Parent FortiGate Serial': '',
-                'Parent FortiGate Platform': '',
-                'Parent FortiGate IP': '',
-                
-                # Section 10: FortiSwitch-Specific Fields (empty)
-                'Device Type': '',
-                'Max PoE Budget': '',
-                'Join Time': '',
-                
-                # Section 11: FortiAP-Specific Fields (empty)
-                'Board MAC': '',
-                'Admin Status': '',
-                'Client Count': '',
-                'Mesh Uplink': '',
-                'WTP Mode': '',
-                'VDOM': ''
-            }
-            flattened.append(row)
+            yield tuple(base_row.values())
+            continue
 
-    return flattened
+        # Create a row for each contract
+        for contract in contracts:
+            row = base_row.copy()
+            row.update({
+                # Section 4: Contract Information
+                'Contract Number': contract.get('name', ''),
+                'Contract Type': contract.get('type', ''),
+                'Contract Summary': contract.get('summary', ''),
+                'Contract Start Date': format_date(contract.get('start_date', '')),
+                'Contract Expiration Date': format_date(contract.get('expiration_date', '')),
+                'Contract Status': contract.get('status', ''),
+                'Contract Archived': 'Yes' if contract.get('archived', False) else 'No'
+            })
+            yield tuple(row.values())
+
+
+def _flatten_chunk(devices: List[Dict]) -> List[Tuple]:
+    """Flatten one chunk of devices; runs in a worker process."""
+    return list(flatten_device_data(devices))
+
+
+def iter_rows(devices: List[Dict]) -> Iterator[Tuple]:
+    """Yield CSV rows for devices, using every CPU core for very large exports."""
+    if len(devices) < FLATTEN_PROCESS_THRESHOLD:
+        yield from flatten_device_data(devices)
+        return
 
+    chunks = [devices[i:i + FLATTEN_CHUNK_SIZE] for i in range(0, len(devices), FLATTEN_CHUNK_SIZE)]
+    with ProcessPoolExecutor() as executor:
+        # Chunks come back in order, so rows keep device order
+        for rows in executor.map(_flatten_chunk, chunks):
+            yield from rows
 
-def export_to_csv(data: List[Dict], filename: str) -> bool:
-    """Export data to CSV file."""
-    if not data:
-        print("WARNING: No data to export")
-        return False
 
-    try:
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            # Unified 60-field structure - same order for all systems
-            fieldnames = [
-                'Serial Number', 'Device Name', 'Hostname', 'Model', 'Description', 
-                'Asset Type', 'Source System',
-                'Management IP', 'Connection Status', 'Management Mode', 'Firmware Version',
-                'Company', 'Organizational Unit', 'Branch', 'Location', 
-                'Folder Path', 'Folder ID', 'Vendor',
-                'Contract Number', 'Contract SKU', 'Contract Type', 'Contract Summary',
-                'Contract Start Date', 'Contract Expiration Date', 'Contract Status',
-                'Contract Support Type', 'Contract Archived',
-                'Entitlement Level', 'Entitlement Type', 
-                'Entitlement Start Date', 'Entitlement End Date',
-                'Status', 'Is Decommissioned', 'Archived', 'Registration Date',
-                'Product EoR', 'Product EoS', 'Last Updated',
-                'Account ID', 'Account Email', 'Account OU ID',
-                'HA Mode', 'HA Cluster Name', 'HA Role', 'HA Member Status', 
-                'HA Priority', 'Max VDOMs',
-                'Parent FortiGate', 'Parent FortiGate Serial', 
-                'Parent FortiGate Platform', 'Parent FortiGate IP',
-                'Device Type', 'Max PoE Budget', 'Join Time',
-                'Board MAC', 'Admin Status', 'Client Count', 'Mesh Uplink', 
-                'WTP Mode', 'VDOM'
-            ]
+def export_to_csv(data: Iterable[Tuple], filename: str) -> int:
+    """
+    Export data to CSV file.
 
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
+    Rows are written as they are produced, so the whole export is never held
+    in memory. Returns the number of rows written (0 if nothing was written).
+    """
+    data = iter(data)
+    first = next(data, None)
+    if first is None:
+        print("WARNING: No data to export")
+        return 0
 
-        return True
+    try:
+        with open(filename, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE) as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(FIELDNAMES)
+            writer.writerow(first)
+            count = 1
+            for row in data:
+                writer.writerow(row)
+                count += 1
+
+        return count
     except Exception as e:
         print(f"ERROR: Failed to write CSV: {e}")
-        return False
+        return 0
 
 
 def main():
@@ -625,16 +617,14 @@ def main():
     enriched_devices = enrich_with_contracts(api, fortiap_devices)
     print()
 
-    print("Step 4: Processing device data...")
-    flattened_data = flatten_device_data(enriched_devices)
-    print(f"Processed {len(flattened_data)} rows")
-    print()
-
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"td_fortiap_devices_{timestamp}.csv"
 
-    print(f"Step 5: Exporting to CSV ({filename})...")
-    if export_to_csv(flattened_data, filename):
+    # Rows are flattened while they are written, one device at a time
+    print(f"Step 4: Processing device data and exporting to CSV ({filename})...")
+    row_count = export_to_csv(iter_rows(enriched_devices), filename)
+    if row_count:
+        print(f"Processed {row_count} rows")
         print(f"SUCCESS: Data exported to {filename}")
     else:
         print("ERROR: Export failed")
@@ -646,7 +636,7 @@ def main():
     print("="*70)
     print(f"Output file: {filename}")
     print(f"Total devices: {len(fortiap_devices)}")
-    print(f"Total rows (with contracts): {len(flattened_data)}")
+    print(f"Total rows (with contracts): {row_count}")
     print()
 
 
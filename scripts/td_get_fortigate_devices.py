@@ -14,12 +14,102 @@ Version: 1.0
 """
 
 import os
+import re
 import sys
 import csv
+import gzip
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 from datetime import datetime
-from typing import Dict, List, Optional
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:  # Fall back to the standard library if orjson isn't installed
+    import json
+
+    _json_loads = json.loads
+
+# Concurrent TopDesk requests while looking up linked contracts
+MAX_WORKERS = 16
+
+# Asset fields requested for every firewall asset page
+_ASSET_FIELDS = 'name,@type,@@summary,@assignments,@status,modificationDate,creationDate,serienummer,model,ip-address,host-name,software-versie,vendor,environment-1,aanschafdatum'
+
+# FortiGate serials (FG/FGT/FGVM followed by alphanumerics) and the serial in
+# SUP.IDENTIFIER.SERIALNUMBER / SUP.SERIALNUMBER contract names
+_FG_SERIAL_RE = re.compile(r'\b(FG[TVW]?[A-Z0-9]{6,})\b', re.IGNORECASE)
+_SUP_SERIAL_RE = re.compile(r'SUP\.(?:[A-Z0-9]+\.)?([A-Z0-9]{8,})', re.IGNORECASE)
+
+# FortiGate markers in a lowercased asset summary: product names, the "fgt"
+# abbreviation, the "fg-" prefix, VM models and common model numbers
+# (30E, 40F, 60F, 70G, ... and VM01V-VM08V)
+_FG_SUMMARY_RE = re.compile(
+    r'fortigate|fortiwifi|fgt|fg-|fortinet vm'
+    r'|30e|40f|60f|70g|80f|90g|100f|200f|300f|600f|vm0[1248]v'
+)
+# FortiGate markers in a lowercased asset name
+_FG_NAME_RE = re.compile(r'fgt|fg-')
+
+# Unified 60-field structure - same order for all systems
+FIELDNAMES = (
+    # Section 1: Core Identification
+    'Serial Number', 'Device Name', 'Hostname', 'Model', 'Description',
+    'Asset Type', 'Source System',
+
+    # Section 2: Network & Connection
+    'Management IP', 'Connection Status', 'Management Mode', 'Firmware Version',
+
+    # Section 3: Organization & Location
+    'Company', 'Organizational Unit', 'Branch', 'Location',
+    'Folder Path', 'Folder ID', 'Vendor',
+
+    # Section 4: Contract Information
+    'Contract Number', 'Contract SKU', 'Contract Type', 'Contract Summary',
+    'Contract Start Date', 'Contract Expiration Date', 'Contract Status',
+    'Contract Support Type', 'Contract Archived',
+
+    # Section 5: Entitlement Information
+    'Entitlement Level', 'Entitlement Type',
+    'Entitlement Start Date', 'Entitlement End Date',
+
+    # Section 6: Lifecycle & Status
+    'Status', 'Is Decommissioned', 'Archived', 'Registration Date',
+    'Product EoR', 'Product EoS', 'Last Updated',
+
+    # Section 7: Account Information
+    'Account ID', 'Account Email', 'Account OU ID',
+
+    # Section 8: FortiGate-Specific Fields
+    'HA Mode', 'HA Cluster Name', 'HA Role', 'HA Member Status',
+    'HA Priority', 'Max VDOMs',
+
+    # Section 9: FortiSwitch/FortiAP Parent Tracking
+    'Parent FortiGate', 'Parent FortiGate Serial',
+    'Parent FortiGate Platform', 'Parent FortiGate IP',
+
+    # Section 10: FortiSwitch-Specific Fields
+    'Device Type', 'Max PoE Budget', 'Join Time',
+
+    # Section 11: FortiAP-Specific Fields
+    'Board MAC', 'Admin Status', 'Client Count', 'Mesh Uplink',
+    'WTP Mode', 'VDOM'
+)
+
+# Row template: every field empty except the values shared by all FortiGate
+# rows; copied and filled in per device/contract. Its key order is FIELDNAMES order
+_ROW_TEMPLATE = {k: '' for k in FIELDNAMES}
+_ROW_TEMPLATE.update({
+    'Asset Type': 'Firewall',
+    'Source System': 'TopDesk'
+})
 
 class TopDeskAPI:
     """TopDesk API client with Basic Authentication."""
@@ -34,24 +124,40 @@ class TopDeskAPI:
         self.base_url = f'{self.host}/tas/api/assetmgmt'
         
         self.session = requests.Session()
+        # Enough pooled keep-alive connections for every worker thread, with
+        # throttled (429) or failing requests retried with backoff
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.auth = HTTPBasicAuth(username, password)
         self.session.headers.update({
             'Accept': 'application/x.topdesk-am-assets-v2+json',
             'User-Agent': 'TopDesk-API-Script/1.0'
         })
+        # Asset details by asset ID, failed lookups included (as None); the
+        # lock guards writes from concurrent worker threads
+        self._detail_cache: Dict[str, Optional[Dict]] = {}
+        self._detail_cache_lock = threading.Lock()
 
     def _log(self, message: str) -> None:
         """Log debug messages if debug mode is enabled."""
         if self.debug:
             print(f"[DEBUG] {message}")
 
-    def get_assets_by_template(self, template_name: str, page_size: int = 1000) -> List[Dict]:
+    def get_assets_by_template(self, template_name: str, page_size: int = 1000,
+                               field_filters: Optional[Dict[str, str]] = None) -> List[Dict]:
         """
         Get all assets by template name with pagination.
 
         Args:
             template_name: Template name to filter by
             page_size: Number of results per page (max 1000)
+            field_filters: Extra query parameters passed to TopDesk as-is
+                (e.g. {'$filter': "..."}) so assets are filtered server-side
 
         Returns:
             List of asset dictionaries
@@ -59,25 +165,43 @@ class TopDeskAPI:
         all_assets = []
         page_start = 0  # Use pageStart, not start!
         
-        while True:
-            params = {
-                'templateName': template_name,
-                'pageSize': page_size,
-                'pageStart': page_start,  # Correct parameter name
-                'fields': 'name,@type,@@summary,@assignments,@status,modificationDate,creationDate,serienummer,model,ip-address,host-name,software-versie,vendor,environment-1,aanschafdatum'
-            }
-            
+        # Built once; only pageStart changes from page to page. Pages are
+        # fetched one at a time on the prefetch worker, so updating it in
+        # place is safe
+        params = {
+            'templateName': template_name,
+            'pageSize': page_size,
+            'pageStart': page_start,  # Correct parameter name
+            'fields': _ASSET_FIELDS
+        }
+        if field_filters:
+            params.update(field_filters)
+        
+        def fetch_page(start: int) -> requests.Response:
+            params['pageStart'] = start
             self._log(f"Request: GET /assets with params: {params}")
             
+            return self.session.get(
+                f"{self.base_url}/assets",
+                params=params,
+                timeout=30
+            )
+        
+        # A single background worker fetches at most one page ahead while the
+        # current page is parsed
+        prefetcher = ThreadPoolExecutor(max_workers=1)
+        next_page = prefetcher.submit(fetch_page, page_start)
+        
+        while True:
             try:
-                response = self.session.get(
-                    f"{self.base_url}/assets",
-                    params=params,
-                    timeout=30
-                )
+                response = next_page.result()
                 response.raise_for_status()
                 
-                data = response.json()
+                # 206 means more results remain, so request the next page now
+                if response.status_code == 206:
+                    next_page = prefetcher.submit(fetch_page, page_start + page_size)
+                
+                data = _json_loads(response.content)
                 assets = data.get('dataSet', [])
                 
                 if not assets:
@@ -86,16 +210,20 @@ class TopDeskAPI:
                 all_assets.extend(assets)
                 self._log(f"Retrieved {len(assets)} assets (total: {len(all_assets)})")
                 
-                # Check if there are more results
-                if len(assets) < page_size:
+                # TopDesk answers 206 only while more results remain; a 200 or a
+                # short page is the last one, so stop without requesting an empty page
+                if len(assets) < page_size or response.status_code != 206:
                     break
                     
                 page_start += page_size  # Increment pageStart
                 
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, ValueError) as e:
                 print(f"ERROR: Request failed: {e}")
+                prefetcher.shutdown(wait=False)
                 raise
         
+        # Don't wait on a prefetched page that turned out not to be needed
+        prefetcher.shutdown(wait=False)
         return all_assets
 
     def get_linked_assets(self, asset_unid: str) -> List[Dict]:
@@ -117,15 +245,33 @@ class TopDeskAPI:
             )
             response.raise_for_status()
             
-            links = response.json()
+            links = _json_loads(response.content)
             self._log(f"Found {len(links)} linked assets for {asset_unid}")
             return links
             
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             # Silently log but don't stop execution
             self._log(f"Failed to retrieve linked assets for {asset_unid}: {e}")
             return []
     
+    def get_linked_assets_bulk(self, asset_unids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        Get linked assets for many assets at once.
+
+        TopDesk has no bulk assetLinks query and link entries do not name
+        their source, so each distinct asset is still one request; those
+        requests are issued concurrently.
+
+        Args:
+            asset_unids: UUIDs of the source assets
+
+        Returns:
+            Dictionary mapping each UUID to its linked asset dictionaries
+        """
+        unique_unids = list(dict.fromkeys(asset_unids))
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            return dict(zip(unique_unids, executor.map(self.get_linked_assets, unique_unids)))
+    
     def get_asset_detail(self, asset_id: str) -> Optional[Dict]:
         """
         Get full details of a specific asset including all custom fields.
@@ -136,6 +282,9 @@ class TopDeskAPI:
         Returns:
             Dictionary with full asset details or None if failed
         """
+        if asset_id in self._detail_cache:
+            return self._detail_cache[asset_id]
+
         try:
             response = self.session.get(
                 f"{self.base_url}/assets/{asset_id}",
@@ -144,11 +293,15 @@ class TopDeskAPI:
             )
             response.raise_for_status()
 
-            return response.json()
+            detail = _json_loads(response.content)
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             self._log(f"Failed to retrieve asset detail for {asset_id}: {e}")
-            return None
+            detail = None
+
+        with self._detail_cache_lock:
+            self._detail_cache[asset_id] = detail
+        return detail
 
     def close(self) -> None:
         """Close the session."""
@@ -186,24 +339,8 @@ def filter_fortigate_devices(assets: List[Dict]) -> List[Dict]:
         if 'fortiwaf' in summary:
             continue
         
-        # Include if any of these patterns match:
-        # - "fortigate" or "fortiwifi" explicitly mentioned
-        # - "fgt" (FortiGate abbreviation)
-        # - "fg-" (FortiGate prefix)
-        # - "fortinet vm" (VM models)
-        # - Model numbers like "40F", "60F", "70G", "100F", etc.
-        if any([
-            'fortigate' in summary,
-            'fortiwifi' in summary,
-            'fgt' in summary or 'fgt' in name,
-            'fg-' in summary or 'fg-' in name,
-            'fortinet vm' in summary,
-            # Common FortiGate model patterns
-            any(model in summary for model in [
-                '30e', '40f', '60f', '70g', '80f', '90g', '100f', '200f', '300f',
-                '600f', '40f-3g4g', 'vm01v', 'vm02v', 'vm04v', 'vm08v'
-            ])
-        ]):
+        # Include if the summary or name carries a FortiGate marker
+        if _FG_SUMMARY_RE.search(summary) or _FG_NAME_RE.search(name):
             fortigate_devices.append(asset)
     
     return fortigate_devices
@@ -222,53 +359,66 @@ def enrich_with_contracts(api: TopDeskAPI, devices: List[Dict]) -> List[Dict]:
     """
     print("Retrieving support contracts for devices...")
     
-    for i, device in enumerate(devices, 1):
-        if i % 10 == 0:
-            print(f"  Processed {i}/{len(devices)} devices...")
-        
-        asset_unid = device.get('unid')
-        if not asset_unid:
-            continue
-        
-        # Get linked assets
-        linked_assets = api.get_linked_assets(asset_unid)
-        
-        # Filter for support contracts and enrich with full details
-        contracts = []
-        for link in linked_assets:
-            if 'support' in link.get('type', '').lower() or 'contract' in link.get('type', '').lower() or 'license' in link.get('type', '').lower():
-                # Get full contract details including dates
-                contract_id = link.get('assetId')
-                if contract_id:
-                    contract_detail = api.get_asset_detail(contract_id)
-                    if contract_detail and 'data' in contract_detail:
-                        data = contract_detail['data']
-                        contracts.append({
-                            'name': link.get('name', 'N/A'),
-                            'type': link.get('type', 'N/A'),
-                            'summary': link.get('summary', 'N/A'),
-                            'status': link.get('status', 'N/A'),
-                            'archived': link.get('archived', False),
-                            'start_date': data.get('aanschafdatum', 'N/A'),  # Purchase/start date
-                            'expiration_date': data.get('vervaldatum', 'N/A'),  # Expiration date
-                            'vendor_id': data.get('vendor', 'N/A'),
-                            'contract_type_id': data.get('contract-type', 'N/A')
-                        })
-                    else:
-                        # Fallback to basic info if detail retrieval fails
-                        contracts.append({
-                            'name': link.get('name', 'N/A'),
-                            'type': link.get('type', 'N/A'),
-                            'summary': link.get('summary', 'N/A'),
-                            'status': link.get('status', 'N/A'),
-                            'archived': link.get('archived', False),
-                            'start_date': 'N/A',
-                            'expiration_date': 'N/A',
-                            'vendor_id': 'N/A',
-                            'contract_type_id': 'N/A'
-                        })
-        
-        device['contracts'] = contracts
+    # Stage 1: linked assets for every device, fetched up front in one batch
+    links_by_unid = api.get_linked_assets_bulk([device['unid'] for device in devices if device.get('unid')])
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        device_links = []
+        for i, device in enumerate(devices, 1):
+            if i % 10 == 0:
+                print(f"  Processed {i}/{len(devices)} devices...")
+            
+            asset_unid = device.get('unid')
+            if not asset_unid:
+                continue
+            
+            linked_assets = links_by_unid[asset_unid]
+            
+            # Filter for support contracts
+            contract_links = []
+            for link in linked_assets:
+                link_type = link.get('type', '').lower()
+                if ('support' in link_type or 'contract' in link_type or 'license' in link_type) and link.get('assetId'):
+                    contract_links.append(link)
+            device_links.append((device, contract_links))
+        
+        # Stage 2: full contract details including dates, fetched concurrently
+        # once per distinct contract even when several devices share it
+        contract_ids = list(dict.fromkeys(link['assetId'] for _, links in device_links for link in links))
+        contract_details = dict(zip(contract_ids, executor.map(api.get_asset_detail, contract_ids)))
+        
+        for device, links in device_links:
+            contracts = []
+            for link in links:
+                contract_detail = contract_details[link['assetId']]
+                if contract_detail and 'data' in contract_detail:
+                    data = contract_detail['data']
+                    contracts.append({
+                        'name': link.get('name', 'N/A'),
+                        'type': link.get('type', 'N/A'),
+                        'summary': link.get('summary', 'N/A'),
+                        'status': link.get('status', 'N/A'),
+                        'archived': link.get('archived', False),
+                        'start_date': data.get('aanschafdatum', 'N/A'),  # Purchase/start date
+                        'expiration_date': data.get('vervaldatum', 'N/A'),  # Expiration date
+                        'vendor_id': data.get('vendor', 'N/A'),
+                        'contract_type_id': data.get('contract-type', 'N/A')
+                    })
+                else:
+                    # Fallback to basic info if detail retrieval fails
+                    contracts.append({
+                        'name': link.get('name', 'N/A'),
+                        'type': link.get('type', 'N/A'),
+                        'summary': link.get('summary', 'N/A'),
+                        'status': link.get('status', 'N/A'),
+                        'archived': link.get('archived', False),
+                        'start_date': 'N/A',
+                        'expiration_date': 'N/A',
+                        'vendor_id': 'N/A',
+                        'contract_type_id': 'N/A'
+                    })
+        
+            device['contracts'] = contracts
     
     print(f"  Completed contract retrieval for {len(devices)} devices")
     return devices
@@ -286,12 +436,12 @@ def format_date(date_str: str) -> str:
     """
     if not date_str or date_str == 'N/A':
         return 'N/A'
+    if not isinstance(date_str, str):
+        return date_str
     
-    try:
-        # TopDesk format: '2024-11-19T23:00:00.000'
-        return date_str.split('T')[0]  # Extract just the date part
-    except:
-        return date_str  # Return as-is if parsing fails
+    # TopDesk format: '2024-11-19T23:00:00.000'; extract just the date part,
+    # strings without a time pass through unchanged
+    return date_str.partition('T')[0]
 
 
 def extract_serial_from_text(text: str) -> Optional[str]:
@@ -302,39 +452,35 @@ def extract_serial_from_text(text: str) -> Optional[str]:
     Also checks for SUP.SERIALNUMBER pattern in contract names.
     Returns first match or None.
     """
-    import re
-    
     # First try FortiGate serial patterns: FG/FGT/FGVM followed by alphanumeric
-    matches = re.findall(r'\b(FG[TVW]?[A-Z0-9]{6,})\b', text, re.IGNORECASE)
-    if matches:
-        return matches[0]
+    match = _FG_SERIAL_RE.search(text)
+    if match:
+        return match.group(1)
     
     # Try contract pattern: SUP.IDENTIFIER.SERIALNUMBER or SUP.SERIALNUMBER
     # Extract the last part after SUP. which should be the serial
-    sup_matches = re.findall(r'SUP\.(?:[A-Z0-9]+\.)?([A-Z0-9]{8,})', text, re.IGNORECASE)
-    if sup_matches:
-        return sup_matches[0]
+    sup_match = _SUP_SERIAL_RE.search(text)
+    if sup_match:
+        return sup_match.group(1)
     
     return None
 
 
-def flatten_device_data(devices: List[Dict]) -> List[Dict]:
+def iter_flattened_rows(devices: List[Dict]) -> Iterator[Tuple]:
     """
     Flatten device data for CSV export with comparable fields to FortiManager/FortiCloud.
 
     Args:
         devices: List of device dictionaries
 
-    Returns:
-        List of flattened dictionaries for CSV export
+    Yields:
+        Flattened rows for CSV export, one at a time, with values in
+        FIELDNAMES order
     """
-    flattened = []
-    
     for device in devices:
         # Extract base information
         name = device.get('name', 'N/A')
         summary = device.get('@@summary', 'N/A')
-        type_name = device.get('@type', {}).get('name', 'N/A')
         status = device.get('@status', 'N/A')
         archived = device.get('archived', False)
         mod_date = device.get('modificationDate', 'N/A')
@@ -346,21 +492,22 @@ def flatten_device_data(devices: List[Dict]) -> List[Dict]:
         hostname_td = device.get('host-name', '') or ''
         firmware_td = device.get('software-versie', '') or ''
         vendor_td = device.get('vendor', '') or ''
-        environment_td = device.get('environment-1', '') or ''
-        creation_date_td = device.get('creationDate', '') or ''
-        purchase_date_td = device.get('aanschafdatum', '') or ''
+        
+        # Checked once, used by both the vendor and model fallbacks below
+        is_fortinet = 'fortinet' in summary.lower()
         
         # Use vendor from TopDesk field if available, otherwise parse from summary
-        vendor = vendor_td if vendor_td else ('Fortinet' if 'fortinet' in summary.lower() else 'Unknown')
+        vendor = vendor_td if vendor_td else ('Fortinet' if is_fortinet else 'Unknown')
         
         # Use model from TopDesk field if available, otherwise parse from summary
         model = model_td  # Use the direct field first
         
         # If model field is empty, try to extract from summary
-        if not model and 'fortinet' in summary.lower():
+        if not model and is_fortinet:
             parts = summary.split()
             for i, part in enumerate(parts):
-                if 'fortigate' in part.lower() or 'fortiwifi' in part.lower():
+                part_lower = part.lower()
+                if 'fortigate' in part_lower or 'fortiwifi' in part_lower:
                     if i + 1 < len(parts):
                         model = f"{part} {parts[i+1]}"
                     else:
@@ -408,226 +555,85 @@ def flatten_device_data(devices: List[Dict]) -> List[Dict]:
         if not serial_number:
             serial_number = extract_serial_from_text(summary) or extract_serial_from_text(name) or 'N/A'
         
-        # Build unified 60-field structure
-        if contracts:
-            # Create a row for each contract
-            for contract in contracts:
-                row = {
-                    # Section 1: Core Identification
-                    'Serial Number': serial_number,
-                    'Device Name': name,
-                    'Hostname': hostname_td or name,
-                    'Model': model,
-                    'Description': summary,
-                    'Asset Type': 'Firewall',
-                    'Source System': 'TopDesk',
-                    
-                    # Section 2: Network & Connection
-                    'Management IP': ip_address_td or '',
-                    'Connection Status': status,
-                    'Management Mode': '',
-                    'Firmware Version': firmware_td or '',
-                    
-                    # Section 3: Organization & Location
-                    'Company': '',
-                    'Organizational Unit': '',
-                    'Branch': branch_name if branch_name != 'N/A' else '',
-                    'Location': location_name if location_name != 'N/A' else '',
-                    'Folder Path': '',
-                    'Folder ID': '',
-                    'Vendor': vendor,
-                    
+        # Device fields shared by every row of this device; the rest of the
+        # unified 60-field structure stays empty
+        base_row = _ROW_TEMPLATE.copy()
+        base_row.update({
+            # Section 1: Core Identification
+            'Serial Number': serial_number,
+            'Device Name': name,
+            'Hostname': hostname_td or name,
+            'Model': model,
+            'Description': summary,
+            
+            # Section 2: Network & Connection
+            'Management IP': ip_address_td or '',
+            'Connection Status': status,
+            'Firmware Version': firmware_td or '',
+            
+            # Section 3: Organization & Location
+            'Branch': branch_name if branch_name != 'N/A' else '',
+            'Location': location_name if location_name != 'N/A' else '',
+            'Vendor': vendor,
+            
+            # Section 6: Lifecycle & Status
+            'Status': status,
+            'Archived': 'Yes' if archived else 'No',
+            'Last Updated': mod_date
+        })
+        
+        # Create a row for each contract, or a single row without contract
+        for contract in contracts or [None]:
+            row = base_row.copy()
+            if contract is not None:
+                row.update({
                     # Section 4: Contract Information
                     'Contract Number': contract.get('name', ''),
-                    'Contract SKU': '',
                     'Contract Type': contract.get('type', ''),
                     'Contract Summary': contract.get('summary', ''),
                     'Contract Start Date': format_date(contract.get('start_date', '')),
                     'Contract Expiration Date': format_date(contract.get('expiration_date', '')),
                     'Contract Status': contract.get('status', ''),
-                    'Contract Support Type': '',
-                    'Contract Archived': 'Yes' if contract.get('archived', False) else 'No',
-                    
-                    # Section 5: Entitlement Information (empty)
-                    'Entitlement Level': '',
-                    'Entitlement Type': '',
-                    'Entitlement Start Date': '',
-                    'Entitlement End Date': '',
-                    
-                    # Section 6: Lifecycle & Status
-                    'Status': status,
-                    'Is Decommissioned': '',
-                    'Archived': 'Yes' if archived else 'No',
-                    'Registration Date': '',
-                    'Product EoR': '',
-                    'Product EoS': '',
-                    'Last Updated': mod_date,
-                    
-                    # Section 7: Account Information (empty)
-                    'Account ID': '',
-                    'Account Email': '',
-                    'Account OU ID': '',
-                    
-                    # Section 8: FortiGate-Specific Fields (empty)
-                    'HA Mode': '',
-                    'HA Cluster Name': '',
-                    'HA Role': '',
-                    'HA Member Status': '',
-                    'HA Priority': '',
-                    'Max VDOMs': '',
-                    
-                    # Section 9: FortiSwitch/FortiAP Parent Tracking (empty)
-                    'Parent FortiGate': '',
-                    'Parent FortiGate Serial': '',
-                    'Parent FortiGate Platform': '',
-                    'Parent FortiGate IP': '',
-                    
-                    # Section 10: FortiSwitch-Specific Fields (empty)
-                    'Device Type': '',
-                    'Max PoE Budget': '',
-                    'Join Time': '',
-                    
-                    # Section 11: FortiAP-Specific Fields (empty)
-                    'Board MAC': '',
-                    'Admin Status': '',
-                    'Client Count': '',
-                    'Mesh Uplink': '',
-                    'WTP Mode': '',
-                    'VDOM': ''
-                }
-                flattened.append(row)
-        else:
-            # Create a single row without contract
-            row = {
-                # Section 1: Core Identification
-                'Serial Number': serial_number,
-                'Device Name': name,
-                'Hostname': hostname_td or name,
-                'Model': model,
-                'Description': summary,
-                'Asset Type': 'Firewall',
-                'Source System': 'TopDesk',
-                
-                # Section 2: Network & Connection
-                'Management IP': ip_address_td or '',
-                'Connection Status': status,
-                'Management Mode': '',
-                'Firmware Version': firmware_td or '',
-                
-                # Section 3: Organization & Location
-                'Company': '',
-                'Organizational Unit': '',
-                'Branch': branch_name if branch_name != 'N/A' else '',
-                'Location': location_name if location_name != 'N/A' else '',
-                'Folder Path': '',
-                'Folder ID': '',
-                'Vendor': vendor,
-                
-                # Section 4: Contract Information (empty)
-                'Contract Number': '',
-                'Contract SKU': '',
-                'Contract Type': '',
-                'Contract Summary': '',
-                'Contract Start Date': '',
-                'Contract Expiration Date': '',
-                'Contract Status': '',
-                'Contract Support Type': '',
-                'Contract Archived': '',
-                
-                # Section 5: Entitlement Information (empty)
-                'Entitlement Level': '',
-                'Entitlement Type': '',
-                'Entitlement Start Date': '',
-                'Entitlement End Date': '',
-                
-                # Section 6: Lifecycle & Status
-                'Status': status,
-                'Is Decommissioned': '',
-                'Archived': 'Yes' if archived else 'No',
-                'Registration Date': '',
-                'Product EoR': '',
-                'Product EoS': '',
-                'Last Updated': mod_date,
-                
-                # Section 7: Account Information (empty)
-                'Account ID': '',
-                'Account Email': '',
-                'Account OU ID': '',
-                
-                # Section 8: FortiGate-Specific Fields (empty)
-                'HA Mode': '',
-                'HA Cluster Name': '',
-                'HA Role': '',
-                'HA Member Status': '',
-                'HA Priority': '',
-                'Max VDOMs': '',
-                
-                # Section 9: FortiSwitch/FortiAP Parent Tracking (empty)
-                'Parent FortiGate': '',
-                'Parent FortiGate Serial': '',
-                'Parent FortiGate Platform': '',
-                'Parent FortiGate IP': '',
-                
-                # Section 10: FortiSwitch-Specific Fields (empty)
-                'Device Type': '',
-                'Max PoE Budget': '',
-                'Join Time': '',
-                
-                # Section 11: FortiAP-Specific Fields (empty)
-                'Board MAC': '',
-                'Admin Status': '',
-                'Client Count': '',
-                'Mesh Uplink': '',
-                'WTP Mode': '',
-                'VDOM': ''
-            }
-            flattened.append(row)
-    
-    return flattened
+                    'Contract Archived': 'Yes' if contract.get('archived', False) else 'No'
+                })
+            yield tuple(row.values())
 
 
-def export_to_csv(data: List[Dict], filename: str) -> bool:
-    """Export data to CSV file."""
-    if not data:
+def export_to_csv(data: Iterable[Tuple], filename: str) -> int:
+    """
+    Export data to CSV file.
+
+    Rows are written as they are produced, so the whole export is never held
+    in memory. A filename ending in '.gz' is written gzip-compressed.
+    Returns the number of rows written (0 if nothing was written).
+    """
+    data = iter(data)
+    first = next(data, None)
+    if first is None:
         print("WARNING: No data to export")
-        return False
+        return 0
     
     try:
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            # Unified 60-field structure - same order for all systems
-            fieldnames = [
-                'Serial Number', 'Device Name', 'Hostname', 'Model', 'Description', 
-                'Asset Type', 'Source System',
-                'Management IP', 'Connection Status', 'Management Mode', 'Firmware Version',
-                'Company', 'Organizational Unit', 'Branch', 'Location', 
-                'Folder Path', 'Folder ID', 'Vendor',
-                'Contract Number', 'Contract SKU', 'Contract Type', 'Contract Summary',
-                'Contract Start Date', 'Contract Expiration Date', 'Contract Status',
-                'Contract Support Type', 'Contract Archived',
-                'Entitlement Level', 'Entitlement Type', 
-                'Entitlement Start Date', 'Entitlement End Date',
-                'Status', 'Is Decommissioned', 'Archived', 'Registration Date',
-                'Product EoR', 'Product EoS', 'Last Updated',
-                'Account ID', 'Account Email', 'Account OU ID',
-                'HA Mode', 'HA Cluster Name', 'HA Role', 'HA Member Status', 
-                'HA Priority', 'Max VDOMs',
-                'Parent FortiGate', 'Parent FortiGate Serial', 
-                'Parent FortiGate Platform', 'Parent FortiGate IP',
-                'Device Type', 'Max PoE Budget', 'Join Time',
-                'Board MAC', 'Admin Status', 'Client Count', 'Mesh Uplink', 
-                'WTP Mode', 'VDOM'
-            ]
-            
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
+        if filename.endswith('.gz'):
+            # Level 3 keeps most of the size reduction at a fraction of the CPU
+            csvfile = gzip.open(filename, 'wt', newline='', encoding='utf-8', compresslevel=3)
+        else:
+            csvfile = open(filename, 'w', newline='', encoding='utf-8')
+        with csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(FIELDNAMES)
+            writer.writerow(first)
+            count = 1
+            for row in data:
+                writer.writerow(row)
+                count += 1
         
         print(f"SUCCESS: Data exported to {filename}")
-        return True
+        return count
         
     except Exception as e:
         print(f"ERROR: Failed to export CSV: {e}")
-        return False
+        return 0
 
 
 def load_config_from_file(filepath: str) -> Dict[str, str]:
@@ -642,18 +648,21 @@ def load_config_from_file(filepath: str) -> Dict[str, str]:
     """
     config = {}
     
-    if not os.path.exists(filepath):
-        return config
-    
+    # One read of the whole file; a missing file simply means no file config
     try:
-        with open(filepath, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and '=' in line and not line.startswith('#'):
-                    key, value = line.split('=', 1)
-                    config[key.strip()] = value.strip()
+        text = Path(filepath).read_text()
+    except FileNotFoundError:
+        return config
     except Exception as e:
         print(f"WARNING: Failed to read config file {filepath}: {e}")
+        return config
+    
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            key, sep, value = line.partition('=')
+            if sep:
+                config[key.strip()] = value.strip()
     
     return config
 
@@ -674,6 +683,10 @@ def main():
     username = file_config.get('topdesk-user') or os.getenv('TOPDESK_USER')
     password = file_config.get('topdesk-pass') or os.getenv('TOPDESK_PASSWORD')
     debug = os.getenv('DEBUG', 'false').lower() == 'true'
+    # Optional TopDesk $filter expression applied server-side when listing
+    # firewall assets; the client-side FortiGate filter still runs afterwards
+    asset_filter = os.getenv('TOPDESK_ASSET_FILTER')
+    gzip_output = os.getenv('TOPDESK_GZIP_OUTPUT', 'false').lower() == 'true'
     
     # Validate configuration
     if not all([host, username, password]):
@@ -689,6 +702,8 @@ def main():
     print(f"TopDesk URL: {host}")
     print(f"Username: {username}")
     print(f"Debug Mode: {debug}")
+    if asset_filter:
+        print(f"Asset Filter: {asset_filter}")
     print()
     
     # Initialize API client
@@ -697,7 +712,8 @@ def main():
     try:
         # Step 1: Get all Firewall [FWL] assets
         print("Step 1: Retrieving all Firewall [FWL] assets...")
-        all_assets = api.get_assets_by_template('Firewall [FWL]')
+        field_filters = {'$filter': asset_filter} if asset_filter else None
+        all_assets = api.get_assets_by_template('Firewall [FWL]', field_filters=field_filters)
         print(f"Retrieved {len(all_assets)} firewall assets")
         print()
         
@@ -716,25 +732,22 @@ def main():
         enriched_devices = enrich_with_contracts(api, fortigate_devices)
         print()
         
-        # Step 4: Flatten device data
-        print("Step 4: Processing device data...")
-        flattened_data = flatten_device_data(enriched_devices)
-        print(f"Processed {len(flattened_data)} rows")
-        print()
-        
-        # Step 5: Export to CSV
+        # Step 4: Flatten device data and stream the rows straight to CSV
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         output_filename = f'td_fortigate_devices_{timestamp}.csv'
+        if gzip_output:
+            output_filename += '.gz'
         
-        print(f"Step 5: Exporting to CSV ({output_filename})...")
-        if export_to_csv(flattened_data, output_filename):
+        print(f"Step 4: Processing device data and exporting to CSV ({output_filename})...")
+        row_count = export_to_csv(iter_flattened_rows(enriched_devices), output_filename)
+        if row_count:
             print()
             print("=" * 70)
             print("EXPORT COMPLETE!")
             print("=" * 70)
             print(f"Output file: {output_filename}")
             print(f"Total devices: {len(fortigate_devices)}")
-            print(f"Total rows (with contracts): {len(flattened_data)}")
+            print(f"Total rows (with contracts): {row_count}")
             print()
         else:
             sys.exit(1)
@@ -72,8 +72,9 @@ class TopDeskAPI:
                 all_assets.extend(assets)
                 self._log(f"Retrieved {len(assets)} assets (total: {len(all_assets)})")
 
-                # Check if there are more results
-                if len(assets) < page_size:
+                # TopDesk answers 206 only while more results remain; a 200 or a
+                # short page is the last one, so stop without requesting an empty page
+                if len(assets) < page_size or response.status_code != 206:
                     break
 
                 page_start += page_size
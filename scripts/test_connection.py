@@ -11,44 +11,155 @@ Date: September 29, 2025
 
 import os
 import sys
-from dotenv import load_dotenv
-import requests
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:  # Fall back to the standard library if orjson isn't installed
+    import json
+
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# Project root and its .env file, resolved from this file's location so the
+# script behaves the same from any working directory
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_DOTENV = os.path.join(_ROOT, '.env')
+
+# requests and python-dotenv are imported only where they are used, so the
+# dependency check can report them missing instead of failing at import time
+_SESSION = None
+_DOTENV_FOUND = None  # Whether .env exists; None until it has been loaded
+_CONFIG = None
+
+# Credentials that are only ever printed masked
+_SENSITIVE = frozenset((
+    'FORTICLOUD_CLIENT_ID',
+    'FORTICLOUD_CLIENT_SECRET',
+    'FORTICLOUD_USERNAME',
+    'FORTICLOUD_PASSWORD'
+))
+
+# Output lines waiting to be written; flushed once per test so progress still
+# shows up test by test
+_OUT = []
+
+# Environment variables read by the tests below
+_CONFIG_VARS = (
+    'FORTICLOUD_CLIENT_ID',
+    'FORTICLOUD_CLIENT_SECRET',
+    'FORTICLOUD_AUTH_URL',
+    'FORTICLOUD_API_BASE_URL',
+    'FORTICLOUD_USERNAME',
+    'FORTICLOUD_PASSWORD'
+)
+
+
+def _say(line=''):
+    """Queue a line of output; _flush() writes everything queued at once."""
+    _OUT.append(line)
+
+
+def _flush():
+    """Write the queued output with a single write call."""
+    if _OUT:
+        sys.stdout.write('\n'.join(_OUT) + '\n')
+        sys.stdout.flush()
+        _OUT.clear()
+
+
+def _ensure_env_loaded():
+    """
+    Load .env into the environment on the first call only.
+
+    Returns True if the .env file exists. The file is simply opened rather
+    than checked for first; a missing file is not an error here.
+    """
+    global _DOTENV_FOUND
+    if _DOTENV_FOUND is None:
+        from dotenv import load_dotenv
+        try:
+            with open(_DOTENV, encoding='utf-8') as f:
+                load_dotenv(stream=f)
+            _DOTENV_FOUND = True
+        except FileNotFoundError:
+            _DOTENV_FOUND = False
+    return _DOTENV_FOUND
+
+
+def _read_config():
+    """Return the stripped values of _CONFIG_VARS ('' when unset), read once."""
+    global _CONFIG
+    if _CONFIG is None:
+        _ensure_env_loaded()
+        _CONFIG = {var: os.environ.get(var, '').strip() for var in _CONFIG_VARS}
+    return _CONFIG
+
+
+def _get_session():
+    """
+    Return the session shared by every request this script makes.
+
+    Created on first use; its pooled keep-alive connection is reused by
+    repeated auth calls, and transient gateway errors (502/503/504) on the
+    token POST are retried with backoff.
+    """
+    global _SESSION
+    if _SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        # raise_on_status=False hands the last response back once retries run
+        # out, so the status is still reported as an authentication failure
+        retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['POST']), raise_on_status=False)
+        _SESSION = requests.Session()
+        _SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry))
+        _SESSION.headers.update({'Content-Type': 'application/json'})
+    return _SESSION
 
 
 def test_dependencies():
     """Test if all required dependencies are installed."""
-    print("Testing Python dependencies...")
+    _say("Testing Python dependencies...")
     
-    try:
-        import requests
-        print(f"  [OK] requests version: {requests.__version__}")
-    except ImportError:
-        print("  [FAIL] requests not found")
-        return False
+    # Look the packages up without importing (executing) them
+    from importlib.metadata import PackageNotFoundError, version
+    from importlib.util import find_spec
     
+    if find_spec('requests') is None:
+        _say("  [FAIL] requests not found")
+        return False
     try:
-        import dotenv
-        print(f"  [OK] python-dotenv installed")
-    except ImportError:
-        print("  [FAIL] python-dotenv not found")
+        _say(f"  [OK] requests version: {version('requests')}")
+    except PackageNotFoundError:
+        _say("  [OK] requests installed")
+    
+    if find_spec('dotenv') is None:
+        _say("  [FAIL] python-dotenv not found")
         return False
+    _say(f"  [OK] python-dotenv installed")
     
-    print()
+    _say()
     return True
 
 
 def test_env_file():
     """Test if .env file exists and has required variables."""
-    print("Testing environment configuration...")
+    _say("Testing environment configuration...")
     
-    if not os.path.exists('.env'):
-        print("  [FAIL] .env file not found")
-        print("    --> Create .env file based on .env.example")
+    if not _ensure_env_loaded():
+        _say("  [FAIL] .env file not found")
+        _say("    --> Create .env file based on .env.example")
         return False
     
-    print("  [OK] .env file exists")
+    _say("  [OK] .env file exists")
     
-    load_dotenv()
+    config = _read_config()
     
     required_vars = [
         'FORTICLOUD_CLIENT_ID',
@@ -59,22 +170,23 @@ def test_env_file():
     
     missing_vars = []
     for var in required_vars:
-        value = os.getenv(var)
-        if not value or value.strip() == '':
+        value = config[var]
+        if not value:
             missing_vars.append(var)
-            print(f"  [FAIL] {var} is not set")
+            _say(f"  [FAIL] {var} is not set")
         else:
             # Mask sensitive values
-            if 'SECRET' in var or 'ID' in var:
-                display_value = value[:4] + '*' * (len(value) - 4) if len(value) > 4 else '***'
+            if var in _SENSITIVE:
+                length = len(value)
+                display_value = f"{value[:4]}{'*' * (length - 4)}" if length > 4 else '***'
             else:
                 display_value = value
-            print(f"  [OK] {var} = {display_value}")
+            _say(f"  [OK] {var} = {display_value}")
     
-    print()
+    _say()
     
     if missing_vars:
-        print(f"  [FAIL] Missing variables: {', '.join(missing_vars)}")
+        _say(f"  [FAIL] Missing variables: {', '.join(missing_vars)}")
         return False
     
     return True
@@ -82,114 +194,121 @@ def test_env_file():
 
 def test_authentication():
     """Test authentication with FortiCloud API."""
-    print("Testing FortiCloud API authentication...")
+    _say("Testing FortiCloud API authentication...")
     
-    load_dotenv()
+    import requests
+    config = _read_config()
     
     # Try both username/password and client_id/client_secret formats
-    username = os.getenv('FORTICLOUD_USERNAME') or os.getenv('FORTICLOUD_CLIENT_ID')
-    password = os.getenv('FORTICLOUD_PASSWORD') or os.getenv('FORTICLOUD_CLIENT_SECRET')
-    auth_url = os.getenv('FORTICLOUD_AUTH_URL')
+    username = config['FORTICLOUD_USERNAME'] or config['FORTICLOUD_CLIENT_ID']
+    password = config['FORTICLOUD_PASSWORD'] or config['FORTICLOUD_CLIENT_SECRET']
+    auth_url = config['FORTICLOUD_AUTH_URL']
     
     try:
-        # FortiCloud uses username/password format
-        payload = {
+        # FortiCloud uses username/password format; encoded to bytes up front
+        # and sent as-is (the session already sets the JSON Content-Type)
+        body = _json_dumps({
             "username": username,
             "password": password,
             "client_id": "assetmanagement",
             "grant_type": "password"
-        }
+        })
         
-        print(f"  --> Connecting to {auth_url}...")
+        _say(f"  --> Connecting to {auth_url}...")
+        _flush()  # Show progress before waiting on the network
         
-        response = requests.post(
+        response = _get_session().post(
             auth_url,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=30
+            data=body,
+            timeout=(5, 30)  # Fail fast on unreachable hosts; allow slow token responses
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = _json_loads(response.content)
             if 'access_token' in data:
-                print("  [OK] Authentication successful!")
-                print(f"  [OK] Token received (expires in {data.get('expires_in', 'unknown')} seconds)")
-                print()
+                _say("  [OK] Authentication successful!")
+                _say(f"  [OK] Token received (expires in {data.get('expires_in', 'unknown')} seconds)")
+                _say()
                 return True
             else:
-                print("  [FAIL] No access token in response")
-                print(f"  Response: {data}")
-                print()
+                _say("  [FAIL] No access token in response")
+                _say(f"  Response: {data}")
+                _say()
                 return False
         else:
-            print(f"  [FAIL] Authentication failed (Status {response.status_code})")
-            print(f"  Response: {response.text}")
-            print()
+            _say(f"  [FAIL] Authentication failed (Status {response.status_code})")
+            # Decode as UTF-8 directly rather than via charset detection
+            _say(f"  Response: {response.content.decode('utf-8', errors='replace')}")
+            _say()
             return False
             
     except requests.exceptions.ConnectionError as e:
-        print(f"  [FAIL] Connection error: Cannot reach {auth_url}")
-        print(f"  Details: {e}")
-        print()
+        _say(f"  [FAIL] Connection error: Cannot reach {auth_url}")
+        _say(f"  Details: {e}")
+        _say()
         return False
     except requests.exceptions.Timeout:
-        print("  [FAIL] Request timed out")
-        print()
+        _say("  [FAIL] Request timed out")
+        _say()
         return False
     except Exception as e:
-        print(f"  [FAIL] Unexpected error: {e}")
-        print()
+        _say(f"  [FAIL] Unexpected error: {e}")
+        _say()
         return False
 
 
 def main():
     """Main test execution."""
-    print("=" * 70)
-    print("FortiCloud API - Connection Test")
-    print("=" * 70)
-    print()
-    
-    # Change to project root if running from scripts directory
-    if os.path.basename(os.getcwd()) == 'scripts':
-        os.chdir('..')
+    _say("=" * 70)
+    _say("FortiCloud API - Connection Test")
+    _say("=" * 70)
+    _say()
     
     # Run tests
     tests_passed = 0
     tests_total = 3
     
-    if test_dependencies():
-        tests_passed += 1
-    
-    if test_env_file():
-        tests_passed += 1
-    
-    if test_authentication():
+    # The remaining tests need requests and python-dotenv, so they only run
+    # once the dependency check has passed; output is written after each test
+    passed = test_dependencies()
+    _flush()
+    if passed:
         tests_passed += 1
+        
+        if test_env_file():
+            tests_passed += 1
+        _flush()
+        
+        if test_authentication():
+            tests_passed += 1
+        _flush()
     
     # Summary
-    print("=" * 70)
-    print(f"Test Results: {tests_passed}/{tests_total} passed")
-    print("=" * 70)
+    _say("=" * 70)
+    _say(f"Test Results: {tests_passed}/{tests_total} passed")
+    _say("=" * 70)
     
     if tests_passed == tests_total:
-        print()
-        print("[SUCCESS] All tests passed!")
-        print("[SUCCESS] Your FortiCloud API setup is working correctly.")
-        print()
-        print("Next steps:")
-        print("  1. Run: python scripts/get_fortigate_devices.py")
-        print("  2. Review the generated CSV file")
-        print()
+        _say()
+        _say("[SUCCESS] All tests passed!")
+        _say("[SUCCESS] Your FortiCloud API setup is working correctly.")
+        _say()
+        _say("Next steps:")
+        _say("  1. Run: python scripts/get_fortigate_devices.py")
+        _say("  2. Review the generated CSV file")
+        _say()
+        _flush()
         return 0
     else:
-        print()
-        print("[FAIL] Some tests failed. Please review the errors above.")
-        print()
-        print("Common solutions:")
-        print("  - Install dependencies: pip install -r requirements.txt")
-        print("  - Create .env file based on .env.example")
-        print("  - Verify your API credentials in FortiCloud IAM")
-        print()
+        _say()
+        _say("[FAIL] Some tests failed. Please review the errors above.")
+        _say()
+        _say("Common solutions:")
+        _say("  - Install dependencies: pip install -r requirements.txt")
+        _say("  - Create .env file based on .env.example")
+        _say("  - Verify your API credentials in FortiCloud IAM")
+        _say()
+        _flush()
         return 1
 
 